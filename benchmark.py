@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+
+'''
+Script Name: Offline benchmark of rescale_rest_api.py
+Runs realistic workloads against fake_rescale_server.py and reports wall time, throughput and
+request counts, so new versions can be compared before they are rolled out.
+
+Scenarios:
+- download_small : job_download of many small output files (default 10000 x 4 KB)
+- download_large : job_download of one large output file (default 1 GB, --large-size 10G for the full run)
+- upload_package : package_and_upload of a generated input directory
+- upload_large   : upload_large_file of one large local file in parallel parts
+- monitor        : monitor_jobs of many jobs from one event loop
+- chain          : file_previous_job over a large listing, archive only and full
+
+Usage: python benchmark.py [scenario ...] [--latency 0.02] [--bandwidth 100M] [--json results.json]
+'''
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import fake_rescale_server as fake
+import rescale_rest_api as rescale
+
+TOKEN = 'Token benchmark'
+
+def _quiet() :
+    # The library prints per file; keep the benchmark output readable
+    return contextlib.redirect_stdout(io.StringIO())
+
+def _server(args, **config) :
+    options = {'latency' : args.latency, 'bandwidth' : args.bandwidth, 'error_rate' : args.error_rate}
+    options.update(config)
+    return fake.FakeRescaleServer(**options)
+
+def _new_job(server) :
+    # Create and submit a job on the fake server, return its ID. Job creation is never resent
+    # on injected 5xx errors, and it is not what is measured, so injection is paused meanwhile.
+    error_rate = server.state.config['error_rate']
+    server.state.config['error_rate'] = 0
+    try :
+        with _quiet() :
+            job_id = rescale.create_job(server.url, TOKEN, {'name' : 'benchmark'})
+            rescale.submit_job_id(server.url, TOKEN, job_id)
+    finally :
+        server.state.config['error_rate'] = error_rate
+    return job_id
+
+def _result(name, wall, num_bytes, server, **extra) :
+    result = {
+        'scenario' : name,
+        'wall_seconds' : round(wall, 3),
+        'bytes' : num_bytes,
+        'mb_per_s' : round(num_bytes / 1024 / 1024 / max(wall, 1e-6), 2),
+        'requests' : sum(server.state.counters.values()),
+        'injected_errors' : server.state.counters.get('injected_errors', 0),
+    }
+    result.update(extra)
+    return result
+
+def download_small(args, workdir) :
+    with _server(args, file_count=args.small_count, file_size=args.small_size, page_size=100) as server :
+        job_id = _new_job(server)
+        start = time.time()
+        with _quiet() :
+            rescale.job_download(server.url, TOKEN, os.path.join(workdir, 'small'), job_id, max_workers=args.workers, page_size=1000)
+        wall = time.time() - start
+        return _result('download_small', wall, args.small_count * args.small_size, server, files=args.small_count)
+
+def download_large(args, workdir) :
+    with _server(args, file_count=0, large_files=[args.large_size]) as server :
+        job_id = _new_job(server)
+        start = time.time()
+        with _quiet() :
+            rescale.job_download(server.url, TOKEN, os.path.join(workdir, 'large'), job_id, max_workers=args.workers)
+        wall = time.time() - start
+        return _result('download_large', wall, args.large_size, server, files=1)
+
+def upload_package(args, workdir) :
+    input_dir = os.path.join(workdir, 'inputs')
+    os.makedirs(os.path.join(input_dir, 'mesh'), exist_ok=True)
+    with open(os.path.join(input_dir, 'mesh', 'model.bin'), 'wb') as f :
+        block = os.urandom(1024 * 1024)
+        for _ in range(args.package_size // len(block)) :
+            f.write(block)
+    with open(os.path.join(input_dir, 'model.inp'), 'w') as f :
+        f.write('*HEADING\n' * 10000)
+
+    with _server(args) as server :
+        start = time.time()
+        with _quiet() :
+            rescale.package_and_upload(server.url, TOKEN, input_dir, workers=args.workers)
+        wall = time.time() - start
+        return _result('upload_package', wall, server.state.bytes_received, server, input_bytes=args.package_size)
+
+def upload_large(args, workdir) :
+    file_path = os.path.join(workdir, 'large_input.bin')
+    with open(file_path, 'wb') as f :
+        f.truncate(args.upload_size)
+
+    with _server(args) as server :
+        start = time.time()
+        with _quiet() :
+            rescale.upload_large_file(server.url, TOKEN, file_path, part_size=args.part_size, max_workers=args.workers)
+        wall = time.time() - start
+        return _result('upload_large', wall, args.upload_size, server, parts=-(-args.upload_size // args.part_size))
+
+def monitor(args, workdir) :
+    with _server(args, queued_seconds=1, executing_seconds=2) as server :
+        job_ids = [_new_job(server) for _ in range(args.jobs)]
+        start = time.time()
+        with _quiet() :
+            rescale.monitor_jobs(server.url, TOKEN, job_ids, poll_policy=rescale.PollPolicy(default_limits=(0.5, 2), limits={
+                status : (0.5, 2) for status in rescale.POLL_LIMITS}))
+        wall = time.time() - start
+        return _result('monitor', wall, 0, server, jobs=args.jobs)
+
+def chain(args, workdir) :
+    with _server(args, file_count=args.small_count, page_size=100) as server :
+        job_id = _new_job(server)
+        start = time.time()
+        with _quiet() :
+            rescale.file_previous_job(server.url, TOKEN, job_id, archive_name='rescale.tar.gz')
+        archive_wall = time.time() - start
+        archive_requests = sum(server.state.counters.values())
+        start = time.time()
+        with _quiet() :
+            inputfiles_list = rescale.file_previous_job(server.url, TOKEN, job_id, page_size=1000)
+        wall = time.time() - start
+        return _result('chain', wall, 0, server, files=len(inputfiles_list),
+                       archive_only_seconds=round(archive_wall, 3), archive_only_requests=archive_requests)
+
+SCENARIOS = {
+    'download_small' : download_small,
+    'download_large' : download_large,
+    'upload_package' : upload_package,
+    'upload_large' : upload_large,
+    'monitor' : monitor,
+    'chain' : chain,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Offline benchmark of rescale_rest_api.py against a fake Rescale API')
+    parser.add_argument('scenarios', nargs='*', help='subset of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--bandwidth', type=fake.parse_size, default=None, help='bytes/s per connection, e.g. 100M')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--small-count', type=int, default=10000)
+    parser.add_argument('--small-size', type=fake.parse_size, default=4096)
+    parser.add_argument('--large-size', type=fake.parse_size, default=fake.parse_size('1G'))
+    parser.add_argument('--package-size', type=fake.parse_size, default=fake.parse_size('256M'))
+    parser.add_argument('--upload-size', type=fake.parse_size, default=fake.parse_size('1G'))
+    parser.add_argument('--part-size', type=fake.parse_size, default=fake.parse_size('64M'))
+    parser.add_argument('--jobs', type=int, default=200)
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+    for name in args.scenarios :
+        if name not in SCENARIOS :
+            parser.error(f'unknown scenario {name}')
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix='rescale_benchmark_')
+    try :
+        for name in args.scenarios or list(SCENARIOS) :
+            result = SCENARIOS[name](args, workdir)
+            results.append(result)
+            print('%-15s %8.2f s %10.2f MB/s %8d requests  %s' % (result['scenario'], result['wall_seconds'], result['mb_per_s'], result['requests'],
+                  ', '.join(f'{k}={v}' for k, v in result.items() if k not in ('scenario', 'wall_seconds', 'mb_per_s', 'requests', 'bytes'))))
+            sys.stdout.flush()
+    finally :
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json :
+        with open(args.json, 'w') as f :
+            json.dump(results, f, indent=2)
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+
+'''
+Script Name: Local stand-in for the Rescale REST-API
+Emulates the endpoints used by rescale_rest_api.py so that uploads, downloads, monitoring and
+job chaining can be measured and regression-tested offline:
+- POST /api/v2/files/contents/                       upload (body is consumed and counted, not stored)
+- GET  /api/v2/files/{id}/                           uploaded file info
+- POST /api/v2/jobs/                                 job creation
+- POST /api/v2/jobs/{id}/submit/                     job submission
+- GET  /api/v2/jobs/{id}/statuses/                   status history (Pending, Queued, Started, Executing, Completed by elapsed time), newest first
+- GET  /api/v2/jobs/{id}/runs/{run}/tail/{file}      last lines of a synthetic, growing log
+- GET  /api/v2/jobs/{id}/files/                      paginated synthetic output listing
+- GET  /download/{job}/{index}                       synthetic file content, with Range support
+Latency, bandwidth, error injection and the output file set are configurable.
+
+Usage: python fake_rescale_server.py --port 8000 --file-count 10000 --file-size 4096 --latency 0.02
+'''
+
+import argparse
+import datetime
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_CONFIG = {
+    'latency' : 0.0,            # seconds added before every response
+    'bandwidth' : None,         # bytes/s per connection for bodies sent and received, None = unlimited
+    'error_rate' : 0.0,         # probability of answering an API call with error_status
+    'error_status' : 503,
+    'retry_after' : 1,          # Retry-After seconds sent with 429/503 errors
+    'file_count' : 100,         # output files per job
+    'file_size' : 4096,         # bytes per output file
+    'large_files' : [],         # extra output file sizes, e.g. [10 * 1024**3]
+    'page_size' : 10,           # default listing page size
+    'max_page_size' : 1000,
+    'queued_seconds' : 0.0,     # job status timeline after submission
+    'started_seconds' : 0.0,
+    'executing_seconds' : 0.0,
+    'log_lines_per_second' : 100,
+    'checksums' : False,        # add sha512 fileChecksums to the listing (small files only)
+}
+
+PATTERN_BLOCK = bytes(range(256)) * 4096
+CHECKSUM_MAX_SIZE = 64 * 1024 * 1024
+
+def synthetic_bytes(seed, start, end) :
+    # Deterministic content of [start, end) for a synthetic file, generated without storage
+    offset = (seed * 7919 + start) % len(PATTERN_BLOCK)
+    length = end - start
+    out = bytearray()
+    while len(out) < length :
+        piece = PATTERN_BLOCK[offset:offset + length - len(out)]
+        out += piece
+        offset = 0
+    return bytes(out)
+
+class FakeRescaleState :
+    def __init__(self, config) :
+        self.config = config
+        self.lock = threading.Lock()
+        self.files = {}
+        self.jobs = {}
+        self.counters = {}
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self._checksums = {}
+
+    def count(self, name) :
+        with self.lock :
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def new_id(self, prefix) :
+        with self.lock :
+            return prefix + '%06d' % (len(self.files) + len(self.jobs) + 1)
+
+    def output_sizes(self) :
+        return [self.config['file_size']] * self.config['file_count'] + list(self.config['large_files'])
+
+    def checksum(self, seed, size) :
+        key = (seed, size)
+        if key not in self._checksums :
+            digest = hashlib.sha512()
+            for start in range(0, size, len(PATTERN_BLOCK)) :
+                digest.update(synthetic_bytes(seed, start, min(start + len(PATTERN_BLOCK), size)))
+            self._checksums[key] = digest.hexdigest()
+        return self._checksums[key]
+
+    def job_statuses(self, job_id) :
+        # Status history reached so far, newest first, as (status, time of the transition)
+        job = self.jobs[job_id]
+        history = [('Pending', job['created'])]
+        if job['submitted'] is not None :
+            since = job['submitted']
+            now = time.time()
+            for status, seconds in (('Queued', self.config['queued_seconds']),
+                                    ('Started', self.config['started_seconds']),
+                                    ('Executing', self.config['executing_seconds']),
+                                    ('Completed', None)) :
+                history.append((status, since))
+                if seconds is None or now < since + seconds :
+                    break
+                since += seconds
+        return history[::-1]
+
+    def job_status(self, job_id) :
+        return self.job_statuses(job_id)[0][0]
+
+class FakeRescaleHandler(BaseHTTPRequestHandler) :
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this Nagle + delayed ACK adds ~40 ms per response
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args) :
+        return
+
+    # Helpers
+    def _throttle(self, num_bytes, start_time) :
+        bandwidth = self.state.config['bandwidth']
+        if bandwidth :
+            delay = num_bytes / bandwidth - (time.time() - start_time)
+            if delay > 0 :
+                time.sleep(delay)
+
+    def _send_json(self, code, obj, headers=()) :
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in headers :
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self) :
+        # Consume (and count) the request body, plain or chunked
+        start_time = time.time()
+        received = 0
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked' :
+            while True :
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0 :
+                    self.rfile.readline()
+                    break
+                remaining = size
+                while remaining :
+                    data = self.rfile.read(min(remaining, 1024 * 1024))
+                    remaining -= len(data)
+                    received += len(data)
+                    self._throttle(received, start_time)
+                self.rfile.readline()
+        else :
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining :
+                data = self.rfile.read(min(remaining, 1024 * 1024))
+                if not data :
+                    break
+                remaining -= len(data)
+                received += len(data)
+                self._throttle(received, start_time)
+        with self.state.lock :
+            self.state.bytes_received += received
+        return received
+
+    def _inject_error(self) :
+        config = self.state.config
+        if config['error_rate'] and random.random() < config['error_rate'] :
+            self.state.count('injected_errors')
+            self._send_json(config['error_status'], {'detail' : 'injected error'},
+                            headers=[('Retry-After', str(config['retry_after']))] if config['error_status'] in (429, 503) else [])
+            return True
+        return False
+
+    def _base_url(self) :
+        host = self.headers.get('Host') or '%s:%d' % self.server.server_address[:2]
+        return 'http://' + host
+
+    # Routes
+    def do_POST(self) :
+        self.state.count('POST ' + re.sub(r'/[A-Za-z]\d{6}', '/{id}', self.path.split('?')[0]))
+        if self.state.config['latency'] :
+            time.sleep(self.state.config['latency'])
+
+        path = self.path.split('?')[0]
+        if path == '/api/v2/files/contents/' :
+            size = self._read_body()
+            if self._inject_error() :
+                return
+            file_id = self.state.new_id('F')
+            with self.state.lock :
+                self.state.files[file_id] = size
+            return self._send_json(201, {'id' : file_id, 'decryptedSize' : size})
+
+        body = self._read_body()
+        if self._inject_error() :
+            return
+        if path == '/api/v2/jobs/' :
+            job_id = self.state.new_id('J')
+            with self.state.lock :
+                self.state.jobs[job_id] = {'created' : time.time(), 'submitted' : None}
+            return self._send_json(201, {'id' : job_id})
+
+        match = re.match(r'^/api/v2/jobs/([^/]+)/submit/$', path)
+        if match and match.group(1) in self.state.jobs :
+            self.state.jobs[match.group(1)]['submitted'] = time.time()
+            return self._send_json(200, {})
+
+        self._send_json(404, {'detail' : 'Not found.'})
+
+    def do_GET(self) :
+        parsed = urllib.parse.urlparse(self.path)
+        path = parsed.path
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        self.state.count('GET ' + re.sub(r'/[A-Za-z]\d{6}', '/{id}', re.sub(r'/download/.*', '/download/', re.sub(r'/tail/.*', '/tail/', path))))
+        if self.state.config['latency'] :
+            time.sleep(self.state.config['latency'])
+
+        match = re.match(r'^/download/([^/]+)/(\d+)$', path)
+        if match :
+            return self._download(match.group(1), int(match.group(2)))
+
+        if self._inject_error() :
+            return
+
+        match = re.match(r'^/api/v2/files/([^/]+)/$', path)
+        if match :
+            if match.group(1) in self.state.files :
+                return self._send_json(200, {'id' : match.group(1), 'decryptedSize' : self.state.files[match.group(1)]})
+            return self._send_json(404, {'detail' : 'Not found.'})
+
+        match = re.match(r'^/api/v2/jobs/([^/]+)/statuses/$', path)
+        if match and match.group(1) in self.state.jobs :
+            history = self.state.job_statuses(match.group(1))
+            return self._send_json(200, {'count' : len(history), 'next' : None, 'results' : [
+                {'status' : status, 'statusDate' : datetime.datetime.fromtimestamp(since, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')}
+                for status, since in history]})
+
+        match = re.match(r'^/api/v2/jobs/([^/]+)/runs/\d+/tail/.+$', path)
+        if match and match.group(1) in self.state.jobs :
+            return self._tail(match.group(1), int(query.get('lines', 10)))
+
+        match = re.match(r'^/api/v2/jobs/([^/]+)/files/$', path)
+        if match and match.group(1) in self.state.jobs :
+            return self._listing(match.group(1), int(query.get('page', 1)), query.get('page_size'))
+
+        self._send_json(404, {'detail' : 'Not found.'})
+
+    def _tail(self, job_id, lines) :
+        job = self.state.jobs[job_id]
+        if job['submitted'] is None :
+            return self._send_json(404, {'detail' : 'Not found.'})
+        total = int((time.time() - job['submitted']) * self.state.config['log_lines_per_second'])
+        first = max(0, total - lines)
+        self._send_json(200, {'lines' : ['%s line %d' % (job_id, i) for i in range(first, total)]})
+
+    def _listing(self, job_id, page, page_size) :
+        config = self.state.config
+        page_size = min(int(page_size or config['page_size']), config['max_page_size'])
+        sizes = self.state.output_sizes()
+        base_url = self._base_url()
+        results = []
+        for index in range((page - 1) * page_size, min(page * page_size, len(sizes))) :
+            relative_path = 'rescale.tar.gz' if index == 0 else 'results/dir%03d/file%06d.dat' % (index % 100, index)
+            record = {
+                'id' : 'O%s_%d' % (job_id, index),
+                'name' : relative_path.rsplit('/', 1)[-1],
+                'path' : job_id + '/run1/' + relative_path,
+                'relativePath' : relative_path,
+                'decryptedSize' : sizes[index],
+                'downloadUrl' : base_url + '/download/%s/%d' % (job_id, index),
+            }
+            if config['checksums'] and sizes[index] <= CHECKSUM_MAX_SIZE :
+                record['fileChecksums'] = [{'hashFunction' : 'sha512', 'fileHash' : self.state.checksum(index, sizes[index])}]
+            results.append(record)
+        next_url = None
+        if page * page_size < len(sizes) :
+            next_url = base_url + '/api/v2/jobs/%s/files/?page=%d&page_size=%d' % (job_id, page + 1, page_size)
+        self._send_json(200, {'count' : len(sizes), 'next' : next_url, 'previous' : None, 'results' : results})
+
+    def _download(self, job_id, index) :
+        sizes = self.state.output_sizes()
+        if index >= len(sizes) :
+            return self._send_json(404, {'detail' : 'Not found.'})
+        if self._inject_error() :
+            return
+        size = sizes[index]
+        start, end = 0, size
+        code = 200
+        range_header = self.headers.get('Range')
+        if range_header :
+            match = re.match(r'bytes=(\d+)-(\d*)', range_header)
+            if match :
+                start = int(match.group(1))
+                end = min(int(match.group(2)) + 1, size) if match.group(2) else size
+                code = 206
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start))
+        if code == 206 :
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, size))
+        self.end_headers()
+
+        start_time = time.time()
+        sent = 0
+        position = start
+        while position < end :
+            chunk_end = min(position + len(PATTERN_BLOCK), end)
+            self.wfile.write(synthetic_bytes(index, position, chunk_end))
+            sent += chunk_end - position
+            position = chunk_end
+            self._throttle(sent, start_time)
+        with self.state.lock :
+            self.state.bytes_sent += sent
+
+class FakeRescaleServer :
+    # In-process server: start() returns the base URL to use as rescale_platform
+    def __init__(self, host='127.0.0.1', port=0, **config) :
+        unknown = set(config) - set(DEFAULT_CONFIG)
+        if unknown :
+            raise ValueError('Unknown fake server options: ' + ', '.join(sorted(unknown)))
+        self.state = FakeRescaleState(dict(DEFAULT_CONFIG, **config))
+        handler = type('Handler', (FakeRescaleHandler,), {'state' : self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) :
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    @property
+    def config(self) :
+        return self.state.config
+
+    def start(self) :
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self) :
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) :
+        self.start()
+        return self
+
+    def __exit__(self, *exc) :
+        self.stop()
+
+def parse_size(text) :
+    # '4096', '64K', '10G' -> bytes
+    match = re.match(r'^(\d+(?:\.\d+)?)([KMGT]?)B?$', str(text).strip().upper())
+    if not match :
+        raise argparse.ArgumentTypeError('Invalid size: ' + str(text))
+    return int(float(match.group(1)) * 1024 ** ' KMGT'.index(match.group(2) or ' '))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local stand-in for the Rescale REST-API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=DEFAULT_CONFIG['latency'])
+    parser.add_argument('--bandwidth', type=parse_size, default=None, help='bytes/s per connection, e.g. 50M')
+    parser.add_argument('--error-rate', type=float, default=DEFAULT_CONFIG['error_rate'])
+    parser.add_argument('--error-status', type=int, default=DEFAULT_CONFIG['error_status'])
+    parser.add_argument('--file-count', type=int, default=DEFAULT_CONFIG['file_count'])
+    parser.add_argument('--file-size', type=parse_size, default=DEFAULT_CONFIG['file_size'])
+    parser.add_argument('--large-file', type=parse_size, action='append', default=[], dest='large_files')
+    parser.add_argument('--queued-seconds', type=float, default=DEFAULT_CONFIG['queued_seconds'])
+    parser.add_argument('--executing-seconds', type=float, default=DEFAULT_CONFIG['executing_seconds'])
+    parser.add_argument('--checksums', action='store_true')
+    args = vars(parser.parse_args())
+
+    server = FakeRescaleServer(args.pop('host'), args.pop('port'), **args)
+    print(f'Fake Rescale API listening on {server.url}')
+    try :
+        server.httpd.serve_forever()
+    except KeyboardInterrupt :
+        server.httpd.server_close()
@@ -19,9 +19,6 @@ Versions:
 - v3 (20231223): Add loop structure for dependent job
 '''
 
-import requests
-from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
-
 import json
 import sys
 import time
@@ -47,6 +44,20 @@ def generate_batch_and_job_names(commands):
 
     return commands_lines, batch_names, job_names, job_id
 
+def generate_pipeline_steps(commands_lines, batch_names, job_names, chain_jobs=True):
+    # Each step depends on the previous one when chained, otherwise all steps are independent.
+    # Jobs nobody depends on are downloaded at the end.
+    steps = []
+    for i, (batch_name, command, job_name) in enumerate(zip(batch_names, commands_lines, job_names)):
+        depends_on = [batch_names[i-1]] if (chain_jobs and i > 0) else []
+        steps.append({'name' : batch_name, 'job_name' : job_name, 'command' : command, 'depends_on' : depends_on})
+
+    parents = {parent for step in steps for parent in step['depends_on']}
+    for step in steps:
+        step['download'] = step['name'] not in parents
+
+    return steps
+
 if __name__ == "__main__":
 
      # User Define section
@@ -54,6 +65,10 @@ if __name__ == "__main__":
 abaqus job=s4b cpus=$RESCALE_CORES_PER_SLOT scratch=$PWD/tmp interactive
 abaqus job=s4b cpus=$RESCALE_CORES_PER_SLOT scratch=$PWD/tmp interactive
 '''
+     chain_jobs = True # True: each command uses the output of the previous one, False: all commands run concurrently
+     max_concurrent_jobs = 4 # Maximum number of Rescale jobs running at the same time
+     journal_file = 'rescale_pipeline.journal' # Pipeline state, kept until all jobs are completed
+     metrics_file = None # e.g. 'rescale_metrics.prom' to export API latency, transfer and polling metrics
      # End of User Define section
 
      # 0. Predefined section by admin
@@ -90,45 +105,68 @@ abaqus job=s4b cpus=$RESCALE_CORES_PER_SLOT scratch=$PWD/tmp interactive
      my_token=None # or 'Token '+'Rescale API key'
 
      # 1. Rescale platform and API token
-     rescale_platform, my_token = rescale.platform_my_token(rescale_platform, my_token)
-
-     # 2. Compress input files as rescale.tar.gz for designated path (Default path is current python execut
-     rescale.create_tar_gz()
-
-     # Generate_batch_and_job_names
-     commands_lines, batch_names, job_names, job_id = generate_batch_and_job_names(commands) 
+     try:
+         rescale_platform, my_token = rescale.platform_my_token(rescale_platform, my_token)
+     except rescale.RescaleError as e:
+         print(e)
+         exit(1)
 
-     # Iterate through jobs
-     for i, (batch_name, command, job_name) in enumerate(zip(batch_names, commands_lines, job_names)):
+     # 1.1 Shared keep-alive connection pool used by every API call and download
+     rescale.get_client(rescale_platform, my_token, pool_size=16)
 
-         now = datetime.datetime.now()  # Declare now for each job
+     # 1.2 Instrumentation of API calls and transfers (disabled unless metrics_file is set)
+     if metrics_file :
+         rescale.enable_metrics()
 
-         if i == 0:
-             # 3. Upload input file to Rescale files (AWS S3) only for the first job
-             inputfiles_list = rescale.upload_local_files(rescale_platform, my_token)
+     # 1.3 In-memory cache of job statuses and of the file listings of completed jobs, so chaining
+     #     and downloading the same job list it only once
+     rescale.enable_metadata_cache()
 
-             # 4. Rescale Job Configuration
-             job_id[i] = rescale.job_setup(rescale_platform, my_token, job_name, command, feature_name, feature_count, code_name, version_code, license_info, coretype_code, core_per_slot, slot, walltime, projectid, inputfiles_list)
+     # 1.4 Status history of every job with its hardware (core type, cores, feature count), kept in
+     #     ~/.config/rescale/job_history.sqlite to compare queue wait and runtime across runs
+     rescale.enable_job_history()
 
-             # 5. Rescale Job Submit
-             rescale.job_submit(rescale_platform, my_token, job_name, job_id[i])
-
-             # 6. Rescale Job Monitor
-             rescale.job_monitor(rescale_platform, my_token, job_id[i])
-
-         if i > 0:
-             # 3.1 Get the ID of the input file in Rescale files (AWS S3) from the previous Rescale Job
-             inputfiles_list = rescale.file_previous_job(rescale_platform, my_token, job_id[i-1])
-
-             # 4.1 Rescale Job Configuration
-             job_id[i] = rescale.job_setup(rescale_platform, my_token, job_name, command, feature_name, feature_count, code_name, version_code, license_info, coretype_code, core_per_slot, slot, walltime, projectid, inputfiles_list)
-
-             # 5.1 Rescale Job Submit
-             rescale.job_submit(rescale_platform, my_token, job_name, job_id[i])
-
-             # 6.1 Rescale Job Monitor
-             rescale.job_monitor(rescale_platform, my_token, job_id[i])
+     # Generate_batch_and_job_names
+     commands_lines, batch_names, job_names, job_id = generate_batch_and_job_names(commands) 
 
-             if i == len(batch_names) - 1:
-                 # 7. Rescale Job Download
-                 rescale.job_download(rescale_platform, my_token, job_name, job_id[i])
+     # 2-3. Compress input files of the current path (sub directories, e.g. downloaded job outputs, are
+     #      not included) on all cores and stream them to Rescale files (AWS S3) for the jobs without dependency.
+     #      Large files go into rescale_static.tar.gz, which is only re-packed and uploaded when one
+     #      of them changes; the small files (e.g. the .inp deck) go into rescale.tar.gz.
+     try:
+         inputfiles_list = rescale.package_incremental(rescale_platform, my_token, recursive=False,
+                                                       exclude=[name for name in (journal_file, metrics_file) if name])
+     except rescale.RescaleError as e:
+         print(e)
+         exit(1)
+
+     # 4-7. Rescale Job Configuration, Submit, Monitor and Download as a pipeline
+     #      A job starts as soon as the jobs it depends on are completed, and independent jobs run concurrently
+     steps = generate_pipeline_steps(commands_lines, batch_names, job_names, chain_jobs)
+     job_settings = {
+         'feature_name' : feature_name,
+         'feature_count' : feature_count,
+         'code_name' : code_name,
+         'version_code' : version_code,
+         'license_info' : license_info,
+         'coretype_code' : coretype_code,
+         'core_per_slot' : core_per_slot,
+         'slot' : slot,
+         'walltime' : walltime,
+         'projectid' : projectid,
+     }
+     #      Progress is journaled so that a re-run after a crash skips finished jobs and reattaches to running ones
+     #      Dependent jobs only take rescale.tar.gz, the output archive packed by the previous job command
+     results = rescale.run_pipeline(rescale_platform, my_token, steps, job_settings, inputfiles_list, max_concurrent_jobs, journal=journal_file, chain_archive='rescale.tar.gz')
+
+     if metrics_file :
+         rescale.get_metrics().export_prometheus(metrics_file)
+
+     # Queue wait, runtime and core-hours of all jobs run so far on this core type
+     rescale.print_job_report(rescale.job_report(coretype=coretype_code))
+
+     if any(result['status'] != 'completed' for result in results.values()) :
+         exit(1)
+
+     # Whole pipeline finished, the next run starts fresh
+     os.remove(journal_file)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+
+'''
+Script Name: Rescale REST-API command line
+Subcommands over rescale_rest_api.py for shells, schedulers and cron jobs:
+- submit   : package the input directory, create and submit a job (optionally monitor and download it)
+- chain    : create and submit a job whose inputs are the output files of a previous job
+- monitor  : follow one job (with live log tail) or many jobs until they are completed
+- download : download the output files of a job, with glob and size filters
+- status   : print the current status of one or more jobs
+- report   : queue wait, runtime and core-hours of past jobs per core type, core count and feature count
+
+The platform and API key are read from ~/.config/rescale/apiconfig (see --apiconfig, --profile).
+Job statuses and the listings of completed jobs are cached in ~/.config/rescale/metadata.sqlite,
+so repeated status checks from shell loops do not all reach the API (see --no-cache). The status
+history and hardware of every job submitted, chained or monitored here go to
+~/.config/rescale/job_history.sqlite for the report.
+
+Usage: python rescale_cli.py status J1 J2
+       python rescale_cli.py submit --code abaqus --version 2022-2241 --coretype starlite_max --command "abaqus job=s4b interactive" --monitor --download
+'''
+
+import argparse
+import datetime
+import getpass
+import os
+import sys
+
+# rescale_rest_api (and with it requests) is only imported once a subcommand runs, so --help and
+# argument errors return at once, and status checks do not load the upload and packaging modules.
+# report only needs rescale_history and never imports it.
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+def _size(text) :
+    # '512', '64K', '1.5G' -> bytes
+    text = text.strip().upper().rstrip('B')
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ''
+    try :
+        return int(float(text[:len(text) - len(unit)]) * SIZE_UNITS[unit])
+    except ValueError :
+        raise argparse.ArgumentTypeError(f'invalid size {text!r}, e.g. 512, 64K, 1G')
+
+def _env_var(text) :
+    key, sep, value = text.partition('=')
+    if not sep or not key :
+        raise argparse.ArgumentTypeError(f'expected KEY=VALUE, got {text!r}')
+    return key, value
+
+def _connect(args, history=False) :
+    # Return (module, platform, token) with the metadata cache enabled unless --no-cache.
+    # The job history is only opened by the subcommands that create or follow jobs.
+    import rescale_rest_api as rescale
+
+    rescale_platform, api_key = rescale.read_apiconfig(args.apiconfig, args.profile)
+    if not args.no_cache :
+        rescale.enable_metadata_cache(args.cache or os.path.join(rescale._config_dir(), 'metadata.sqlite'))
+    if history :
+        rescale.enable_job_history(args.history)
+    return rescale, rescale_platform, 'Token ' + api_key
+
+# 1. status
+def cmd_status(args) :
+    rescale, rescale_platform, my_token = _connect(args)
+    client = rescale.get_client(rescale_platform, my_token)
+    exit_code = 0
+    for job_id in args.job_ids :
+        # One unknown job does not hide the status of the others
+        try :
+            print(job_id, rescale.get_job_status(client, job_id))
+        except rescale.RescaleError as e :
+            print(e, file=sys.stderr)
+            exit_code = 1
+    return exit_code
+
+# 2. monitor
+def cmd_monitor(args) :
+    rescale, rescale_platform, my_token = _connect(args, history=True)
+    if len(args.job_ids) == 1 :
+        rescale.job_monitor(rescale_platform, my_token, args.job_ids[0], tail_mirror=args.mirror)
+    else :
+        final_status = rescale.monitor_jobs(rescale_platform, my_token, args.job_ids, max_in_flight=args.max_in_flight)
+        if any(final_status.get(job_id) not in rescale.JOB_TERMINAL_STATUSES for job_id in args.job_ids) :
+            return 1
+    return 0
+
+# 3. download
+def cmd_download(args) :
+    rescale, rescale_platform, my_token = _connect(args)
+    # One pooled connection per file worker and per range worker
+    rescale.get_client(rescale_platform, my_token, pool_size=max(rescale.DEFAULT_POOL_SIZE, 2 * args.workers))
+    rescale.job_download(rescale_platform, my_token, args.dest or args.job_id, args.job_id, max_workers=args.workers, resume=args.resume,
+                         include=args.include, exclude=args.exclude, min_size=args.min_size, max_size=args.max_size, dry_run=args.dry_run)
+    return 0
+
+# 4. submit and chain
+def _submit(args, rescale, rescale_platform, my_token, inputfiles_list) :
+    job_name = args.job_name or f"{getpass.getuser()}@job@{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    job_id = rescale.job_setup(rescale_platform, my_token, job_name, args.command, args.feature_name, args.feature_count,
+                               args.code, args.version, dict(args.env), args.coretype, args.cores_per_slot, args.slots,
+                               args.walltime, args.project, inputfiles_list)
+    rescale.job_submit(rescale_platform, my_token, job_name, job_id)
+
+    if args.monitor or args.download :
+        rescale.job_monitor(rescale_platform, my_token, job_id)
+    if args.download :
+        rescale.job_download(rescale_platform, my_token, job_name, job_id)
+    return 0
+
+def cmd_submit(args) :
+    rescale, rescale_platform, my_token = _connect(args, history=True)
+    inputfiles_list = rescale.package_incremental(rescale_platform, my_token, args.input_path, recursive=args.recursive, exclude=args.exclude)
+    return _submit(args, rescale, rescale_platform, my_token, inputfiles_list)
+
+def cmd_chain(args) :
+    rescale, rescale_platform, my_token = _connect(args, history=True)
+    archive_name = None if (args.include or args.exclude) else args.archive
+    inputfiles_list = rescale.file_previous_job(rescale_platform, my_token, args.previous_job_id, archive_name=archive_name,
+                                                include=args.include, exclude=args.exclude)
+    return _submit(args, rescale, rescale_platform, my_token, inputfiles_list)
+
+# 5. report
+def cmd_report(args) :
+    # Only reads the history file, so the HTTP client (rescale_rest_api, requests) is not loaded
+    import rescale_history
+    rows = rescale_history.job_report(args.history, args.coretype)
+    if args.json :
+        import json
+        print(json.dumps(rows, indent=2))
+    else :
+        rescale_history.print_job_report(rows)
+    return 0
+
+def build_parser() :
+    parser = argparse.ArgumentParser(description='Rescale REST-API command line')
+    parser.add_argument('--apiconfig', help='apiconfig file (default ~/.config/rescale/apiconfig)')
+    parser.add_argument('--profile', default='default', help='apiconfig profile section')
+    parser.add_argument('--cache', help='metadata cache file (default ~/.config/rescale/metadata.sqlite)')
+    parser.add_argument('--no-cache', action='store_true', help='always ask the API')
+    parser.add_argument('--history', help='job history file (default ~/.config/rescale/job_history.sqlite)')
+    subparsers = parser.add_subparsers(dest='subcommand', metavar='subcommand')
+    subparsers.required = True
+
+    status = subparsers.add_parser('status', help='print the current status of jobs')
+    status.add_argument('job_ids', nargs='+', metavar='job_id')
+    status.set_defaults(func=cmd_status)
+
+    report = subparsers.add_parser('report', help='queue wait, runtime and core-hours of past jobs per hardware')
+    report.add_argument('--coretype', help='only this core type')
+    report.add_argument('--json', action='store_true', help='print the rows as JSON')
+    report.set_defaults(func=cmd_report)
+
+    monitor = subparsers.add_parser('monitor', help='follow jobs until they are completed')
+    monitor.add_argument('job_ids', nargs='+', metavar='job_id')
+    monitor.add_argument('--mirror', help='append the tailed log of a single job to this file')
+    monitor.add_argument('--max-in-flight', type=int, help='concurrent status requests for many jobs')
+    monitor.set_defaults(func=cmd_monitor)
+
+    download = subparsers.add_parser('download', help='download the output files of a job')
+    download.add_argument('job_id')
+    download.add_argument('--dest', help='local directory (default: the job ID)')
+    download.add_argument('--include', action='append', help='glob of files to download, repeatable')
+    download.add_argument('--exclude', action='append', help='glob of files to skip, repeatable')
+    download.add_argument('--min-size', type=_size)
+    download.add_argument('--max-size', type=_size)
+    download.add_argument('--workers', type=int, default=8)
+    download.add_argument('--resume', action='store_true', help='skip files already downloaded, continue partial ones')
+    download.add_argument('--dry-run', action='store_true', help='only list what would be downloaded')
+    download.set_defaults(func=cmd_download)
+
+    # Job settings shared by submit and chain
+    job = argparse.ArgumentParser(add_help=False)
+    job.add_argument('--command', required=True, help='job command')
+    job.add_argument('--job-name')
+    job.add_argument('--code', required=True, help='analysis code, e.g. abaqus')
+    job.add_argument('--version', required=True, help='analysis version code, e.g. 2022-2241')
+    job.add_argument('--coretype', required=True, help='core type code, e.g. starlite_max')
+    job.add_argument('--cores-per-slot', type=int, default=1)
+    job.add_argument('--slots', type=int, default=1)
+    job.add_argument('--walltime', type=int, default=2, help='hours')
+    job.add_argument('--project', help='project ID')
+    job.add_argument('--feature-name', default='', help='license feature for explicit checkout')
+    job.add_argument('--feature-count', type=int, default=0)
+    job.add_argument('--env', type=_env_var, action='append', default=[], metavar='KEY=VALUE', help='environment variable, repeatable (e.g. LM_LICENSE_FILE=27003@mgmt0)')
+    job.add_argument('--monitor', action='store_true', help='follow the job until it is completed')
+    job.add_argument('--download', action='store_true', help='monitor, then download the outputs')
+
+    submit = subparsers.add_parser('submit', parents=[job], help='package inputs, create and submit a job')
+    submit.add_argument('--input-path', help='input directory (default: current directory)')
+    submit.add_argument('--recursive', action='store_true', help='also pack sub directories (job output directories are skipped)')
+    submit.add_argument('--exclude', action='append', default=[], help='glob of input files not to pack, repeatable')
+    submit.set_defaults(func=cmd_submit)
+
+    chain = subparsers.add_parser('chain', parents=[job], help='submit a job on the outputs of a previous job')
+    chain.add_argument('previous_job_id')
+    chain.add_argument('--archive', default='rescale.tar.gz', help='output archive of the previous job to forward')
+    chain.add_argument('--include', action='append', help='forward the files matching this glob instead of the archive, repeatable')
+    chain.add_argument('--exclude', action='append', help='glob of files not to forward, repeatable')
+    chain.set_defaults(func=cmd_chain)
+
+    return parser
+
+def main(argv=None) :
+    args = build_parser().parse_args(argv)
+    try :
+        return args.func(args)
+    except KeyboardInterrupt :
+        return 130
+    except Exception as e :
+        import rescale_rest_api as rescale
+        if isinstance(e, rescale.RescaleError) :
+            print(e, file=sys.stderr)
+            return 1
+        raise
+
+if __name__ == "__main__":
+    sys.exit(main())
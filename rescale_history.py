@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+'''
+Script Name: Rescale job history
+Job status history and hardware of past jobs in a sqlite file, and the queue wait, runtime and
+core-hours report built from it. Only the standard library is imported, so reading the report
+(rescale_cli.py report) does not load requests and the HTTP client of rescale_rest_api.py,
+which records into this history (see enable_job_history there).
+'''
+
+import datetime
+import os
+import platform
+import threading
+import time
+
+# 10. Job history and analytics
+# create_job records the hardware of every job (core type, cores per slot, slots, license
+# features) and get_job_status records each status of the history returned by the API with its
+# statusDate, so a status passed between two polls keeps its real time. job_report aggregates
+# queue wait (Queued -> Started), runtime (Executing -> Completed), turnaround
+# (Queued -> Completed) and core-hours per core type, core count and feature count, in a sqlite
+# file kept across runs.
+def _config_dir() :
+    if (platform.system() == 'Windows' ):
+        return os.environ['USERPROFILE']+"\\.config\\rescale"
+    return os.environ['HOME']+"/.config/rescale"
+
+def _job_history_path() :
+    return os.path.join(_config_dir(), 'job_history.sqlite')
+
+def _status_time(status_date) :
+    # ISO 8601 statusDate -> epoch seconds (UTC when no offset), None when missing or unreadable
+    if not status_date :
+        return None
+    for date_format in ('%Y-%m-%dT%H:%M:%S.%f%z', '%Y-%m-%dT%H:%M:%S%z', '%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S') :
+        try :
+            date = datetime.datetime.strptime(status_date, date_format)
+        except ValueError :
+            continue
+        if date.tzinfo is None :
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        return date.timestamp()
+    return None
+
+class JobHistory :
+    def __init__(self, path=None) :
+        import sqlite3
+        self.path = path or _job_history_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.lock = threading.Lock()
+        # (platform, job_id, status) already stored, so repeated polls do not write again
+        self.recorded = set()
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self.db :
+            self.db.execute('CREATE TABLE IF NOT EXISTS jobs (platform TEXT, job_id TEXT, job_name TEXT, coretype TEXT, cores_per_slot INTEGER, '
+                            'slots INTEGER, feature_name TEXT, feature_count INTEGER, created REAL, PRIMARY KEY (platform, job_id))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS job_statuses (platform TEXT, job_id TEXT, status TEXT, at REAL, PRIMARY KEY (platform, job_id, status))')
+
+    def record_job(self, rescale_platform, job_id, job_spec) :
+        analysis = job_spec['jobanalyses'][0]
+        hardware = analysis.get('hardware', {})
+        features = [feature for feature_set in analysis.get('userDefinedLicenseSettings', {}).get('featureSets', [])
+                    for feature in feature_set.get('features', [])]
+        with self.lock, self.db :
+            self.db.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                rescale_platform, job_id, job_spec.get('name'), hardware.get('coreType'),
+                int(hardware.get('coresPerSlot') or 1), int(hardware.get('slots') or 1),
+                ','.join(feature['name'] for feature in features), sum(int(feature['count']) for feature in features),
+                time.time()))
+
+    def record_statuses(self, rescale_platform, job_id, statuses) :
+        # statuses: [(status, statusDate)] newest first; the newest gets the current time when undated
+        now = time.time()
+        rows = []
+        for index, (status, status_date) in enumerate(statuses) :
+            at = _status_time(status_date) or (now if index == 0 else None)
+            if status and at is not None and (rescale_platform, job_id, status) not in self.recorded :
+                rows.append((rescale_platform, job_id, status, at))
+        if not rows :
+            return
+        with self.lock, self.db :
+            self.db.executemany('INSERT OR IGNORE INTO job_statuses VALUES (?, ?, ?, ?)', rows)
+            self.recorded.update(row[:3] for row in rows)
+
+    def status_history(self, rescale_platform, job_id) :
+        # [(status, epoch seconds)] in time order
+        with self.lock :
+            return self.db.execute('SELECT status, at FROM job_statuses WHERE platform = ? AND job_id = ? ORDER BY at',
+                                   (rescale_platform, job_id)).fetchall()
+
+    def report(self, coretype=None) :
+        # One row per (coretype, cores, feature_count), shortest mean turnaround first
+        query = ('SELECT j.platform, j.job_id, j.coretype, j.cores_per_slot * j.slots, j.feature_count, s.status, s.at '
+                 'FROM jobs j JOIN job_statuses s ON s.platform = j.platform AND s.job_id = j.job_id')
+        params = ()
+        if coretype :
+            query += ' WHERE j.coretype = ?'
+            params = (coretype,)
+        jobs = {}
+        with self.lock :
+            for platform_url, job_id, job_coretype, cores, feature_count, status, at in self.db.execute(query, params) :
+                jobs.setdefault((platform_url, job_id), ((job_coretype, cores, feature_count), {}))[1][status] = at
+
+        groups = {}
+        for hardware, times in jobs.values() :
+            group = groups.setdefault(hardware, {'jobs' : 0, 'completed' : 0, 'queue_wait' : [], 'runtime' : [], 'turnaround' : [], 'core_hours' : 0.0})
+            group['jobs'] += 1
+            queued = times.get('Queued')
+            started = times.get('Started') or times.get('Validated') or times.get('Executing')
+            executing = times.get('Executing')
+            completed = times.get('Completed')
+            if queued is not None and started is not None :
+                group['queue_wait'].append(started - queued)
+            if completed is not None :
+                group['completed'] += 1
+                if executing is not None :
+                    group['runtime'].append(completed - executing)
+                    group['core_hours'] += (completed - executing) * hardware[1] / 3600
+                if queued is not None :
+                    group['turnaround'].append(completed - queued)
+
+        def mean(values) :
+            return sum(values) / len(values) if values else None
+
+        rows = []
+        for (job_coretype, cores, feature_count), group in groups.items() :
+            rows.append({
+                'coretype' : job_coretype,
+                'cores' : cores,
+                'feature_count' : feature_count,
+                'jobs' : group['jobs'],
+                'completed' : group['completed'],
+                'queue_wait' : mean(group['queue_wait']),
+                'max_queue_wait' : max(group['queue_wait'], default=None),
+                'runtime' : mean(group['runtime']),
+                'turnaround' : mean(group['turnaround']),
+                'core_hours' : group['core_hours'],
+            })
+        rows.sort(key=lambda row: (row['turnaround'] is None, row['turnaround'] or 0))
+        return rows
+
+    def close(self) :
+        self.db.close()
+
+def print_job_report(rows) :
+    # Seconds are shown as minutes; '-' when no job of the group reached that status
+    def minutes(seconds) :
+        return '-' if seconds is None else '%.1f' % (seconds / 60)
+
+    print('%-20s %6s %8s %5s %10s %10s %12s %11s %11s' % ('coretype', 'cores', 'features', 'jobs', 'queue[min]', 'max queue', 'runtime[min]',
+                                                           'turnaround', 'core-hours'))
+    for row in rows :
+        print('%-20s %6d %8d %5d %10s %10s %12s %11s %11.2f' % (row['coretype'], row['cores'], row['feature_count'], row['jobs'],
+              minutes(row['queue_wait']), minutes(row['max_queue_wait']), minutes(row['runtime']), minutes(row['turnaround']), row['core_hours']))
+
+def job_report(path=None, coretype=None) :
+    # Report rows from the history file at path (default ~/.config/rescale/job_history.sqlite)
+    history = JobHistory(path)
+    try :
+        return history.report(coretype)
+    finally :
+        history.close()
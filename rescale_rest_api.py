@@ -20,77 +20,869 @@ Versions:
 '''
 
 import requests
-from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
 
+# requests_toolbelt, tarfile, asyncio and sqlite3 are imported by the functions that use them,
+# so short-lived callers (status checks from shell loops) do not pay for them at start-up
 import json
 import sys
 import time
 import os
 import platform
-import tarfile
+import hashlib
+import threading
+import queue
+import struct
+import uuid
+import random
+import email.utils
+import zlib
+import concurrent.futures
+import collections
+import fnmatch
+import re
+
+import rescale_history
+from rescale_history import _config_dir, JobHistory, print_job_report
+
+# 0. Shared HTTP client
+# Every call goes through one keep-alive session per (platform, token) so status polls,
+# tail requests, listing pages and file downloads reuse TCP/TLS connections.
+# The API host and the download (S3) hosts get separate connection pools.
+# Every request has a (connect, read) timeout, so a stalled connection fails and is retried
+# instead of blocking a monitor or download worker forever.
+DEFAULT_POOL_SIZE = 16
+DEFAULT_TIMEOUT = (10, 120)
+RATE_LIMIT_MAX_WAIT = 300
+
+# 0.0 Errors
+# Library functions raise these instead of calling exit(1); main.py turns them into an exit code.
+class RescaleError(Exception) :
+    # Base class of every error raised by this module
+    pass
+
+class RescaleConfigError(RescaleError) :
+    # Missing or invalid apiconfig
+    pass
+
+class RescaleApiError(RescaleError) :
+    # Non-success response from the Rescale API
+    def __init__(self, message, status_code=None, text=None) :
+        super().__init__(message)
+        self.status_code = status_code
+        self.text = text
+
+class RescaleTransientError(RescaleApiError) :
+    # 429/5xx or malformed response that persisted through every retry
+    pass
+
+class RescaleConnectionError(RescaleError) :
+    # Network failure that persisted through every retry
+    pass
+
+class CircuitOpenError(RescaleError) :
+    # The API host failed too often recently, requests are refused until reset_timeout passes
+    pass
+
+# 0.0.1 Retry policy and circuit breaker
+# Idempotent requests (GET/HEAD/PUT/DELETE/OPTIONS, or idempotent=True) are retried on
+# connection errors, timeouts and TRANSIENT_STATUSES with exponential backoff and full jitter;
+# 429 and 503 responses wait for Retry-After instead. Other requests (job creation, uploads)
+# are only resent on 429, which guarantees they were not processed. Consecutive failures of
+# the API host open a circuit breaker so that a sustained outage fails fast instead of piling
+# up retries.
+TRANSIENT_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+class RetryPolicy :
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0) :
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt) :
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+class CircuitBreaker :
+    def __init__(self, failure_threshold=5, reset_timeout=30.0) :
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+
+    def before_request(self) :
+        with self.lock :
+            if self.opened_at is None :
+                return
+            remaining = self.reset_timeout - (time.time() - self.opened_at)
+            if remaining > 0 :
+                raise CircuitOpenError('Rescale API unavailable, retry in %.0f s' % remaining)
+            # Half open: let this request through as a trial
+            self.opened_at = None
+            self.failures = self.failure_threshold - 1
+
+    def record_success(self) :
+        with self.lock :
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self) :
+        with self.lock :
+            self.failures += 1
+            if self.failures >= self.failure_threshold :
+                self.opened_at = time.time()
+
+def _retry_after(response) :
+    # Seconds to wait before retrying a rate limited response, or None when not rate limited
+    if response.status_code != 429 and not (response.status_code == 503 and 'Retry-After' in response.headers) :
+        return None
+    value = response.headers.get('Retry-After')
+    wait = 1.0
+    if value :
+        try :
+            wait = float(value)
+        except ValueError :
+            try :
+                wait = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError) :
+                wait = 1.0
+    # Jitter so that many clients limited at once do not come back together
+    return min(max(wait, 0), RATE_LIMIT_MAX_WAIT) * random.uniform(1.0, 1.2)
+
+def _replayable(kwargs) :
+    # Streams and generators are consumed by the first attempt and cannot be sent again
+    data = kwargs.get('data')
+    return data is None or isinstance(data, (bytes, str, dict))
+
+def check_response(response, expected, message) :
+    # Raise the matching RescaleApiError unless response.status_code is one of expected
+    if response.status_code in expected :
+        return response
+    error = RescaleTransientError if response.status_code in TRANSIENT_STATUSES else RescaleApiError
+    raise error(f'{message} (HTTP {response.status_code})', response.status_code, response.text)
+
+class RescaleClient :
+    def __init__(self, rescale_platform, my_token, pool_size=DEFAULT_POOL_SIZE, retry_policy=None, circuit_breaker=None, timeout=DEFAULT_TIMEOUT) :
+        self.rescale_platform = rescale_platform.rstrip('/')
+        self.my_token = my_token
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy()
+        # Only guards the API host; download hosts fail per file
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+
+        self.session = requests.Session()
+        self.session.headers.update({'Authorization' : my_token})
+
+        # Pool for the Rescale API host
+        self.api_adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        # Pool for everything else (S3 download URLs and redirects)
+        self.download_adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+
+        self.session.mount('https://', self.download_adapter)
+        self.session.mount('http://', self.download_adapter)
+        self.session.mount(self.rescale_platform, self.api_adapter)
+
+    def url(self, path) :
+        # Accept both absolute URLs (downloadUrl, next page) and API paths
+        if path.startswith('http://') or path.startswith('https://') :
+            return path
+        return self.rescale_platform + path
+
+    def request(self, method, path, idempotent=None, **kwargs) :
+        url = self.url(path)
+        replayable = _replayable(kwargs)
+        retryable = replayable and (method in IDEMPOTENT_METHODS if idempotent is None else idempotent)
+        breaker = self.circuit_breaker if url.startswith(self.rescale_platform) else None
+        max_attempts = self.retry_policy.max_attempts
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(max_attempts) :
+            if breaker is not None :
+                breaker.before_request()
+            try :
+                if _metrics is None :
+                    response = self.session.request(method, url, **kwargs)
+                else :
+                    response = self._instrumented_request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e :
+                if breaker is not None :
+                    breaker.record_failure()
+                if not retryable or attempt == max_attempts - 1 :
+                    raise RescaleConnectionError(f'{method} {url} failed: {e}') from e
+                if _metrics is not None :
+                    _metrics.count('retries')
+                time.sleep(self.retry_policy.backoff(attempt))
+                continue
+
+            if response.status_code not in TRANSIENT_STATUSES :
+                if breaker is not None :
+                    breaker.record_success()
+                return response
+
+            # 429 is the server protecting itself, not an outage
+            if breaker is not None and response.status_code != 429 :
+                breaker.record_failure()
+            retry_after = _retry_after(response)
+            # A rate limited request was not processed, so any replayable request may be resent
+            if attempt == max_attempts - 1 or not (retryable or (response.status_code == 429 and replayable)) :
+                return response
+            response.close()
+            if _metrics is not None :
+                _metrics.count('rate_limited' if retry_after is not None else 'retries')
+            time.sleep(retry_after if retry_after is not None else self.retry_policy.backoff(attempt))
+        return response
+
+    def _instrumented_request(self, method, url, **kwargs) :
+        metrics = _metrics
+        endpoint = _endpoint(self, url)
+        start_time = time.perf_counter()
+        try :
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException :
+            metrics.observe_request(method, endpoint, 'error', time.perf_counter() - start_time)
+            raise
+        # Time to response headers; streamed bodies are accounted as transfers
+        metrics.observe_request(method, endpoint, response.status_code, time.perf_counter() - start_time)
+        return response
+
+    def get(self, path, **kwargs) :
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs) :
+        return self.request('POST', path, **kwargs)
+
+    def close(self) :
+        self.session.close()
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client(rescale_platform, my_token, pool_size=None, retry_policy=None, circuit_breaker=None, timeout=None) :
+    # Return the shared client for this platform/token, creating it on first use.
+    # Passing a different pool_size replaces the cached client.
+    # timeout is (connect, read) seconds, or None to keep the client's (DEFAULT_TIMEOUT when new).
+    key = (rescale_platform.rstrip('/'), my_token)
+    with _clients_lock :
+        client = _clients.get(key)
+        if client is None or (pool_size is not None and pool_size != client.pool_size) :
+            if client is not None :
+                client.close()
+            client = RescaleClient(rescale_platform, my_token, pool_size or DEFAULT_POOL_SIZE)
+            _clients[key] = client
+        if retry_policy is not None :
+            client.retry_policy = retry_policy
+        if circuit_breaker is not None :
+            client.circuit_breaker = circuit_breaker
+        if timeout is not None :
+            client.timeout = timeout
+    return client
+
+# 0.1 Instrumentation
+# Disabled by default: every hook is a single 'if _metrics is not None' check. When enabled
+# (enable_metrics), the client records a latency histogram and status counts per endpoint,
+# uploads and downloads record bytes and transfer time, and monitors count status polls.
+# Snapshots are written as a Prometheus text file or appended as JSON lines.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+_ENDPOINT_PATTERNS = (
+    (re.compile(r'/api/v2/(jobs|files)/(?!contents/)[^/?]+'), r'/api/v2/\1/{id}'),
+    (re.compile(r'/runs/[^/?]+'), '/runs/{run}'),
+    (re.compile(r'/tail/.*'), '/tail/{file}'),
+)
+
+# Folded paths used as labels; any other path on the API host is counted as 'other', so an
+# unexpected URL scheme (one path per file or per page) cannot grow the number of series
+_ENDPOINTS = frozenset((
+    '/api/v2/jobs/',
+    '/api/v2/jobs/{id}/',
+    '/api/v2/jobs/{id}/submit/',
+    '/api/v2/jobs/{id}/statuses/',
+    '/api/v2/jobs/{id}/files/',
+    '/api/v2/jobs/{id}/runs/{run}/tail/{file}',
+    '/api/v2/files/contents/',
+    '/api/v2/files/{id}/',
+    '/api/v2/files/{id}/contents/',
+))
+
+def _endpoint(client, url) :
+    # Label for a request URL: API path with IDs folded, 'download' for other hosts, 'other' for unknown paths
+    if not url.startswith(client.rescale_platform) :
+        return 'download'
+    path = url[len(client.rescale_platform):].split('?', 1)[0]
+    for pattern, replacement in _ENDPOINT_PATTERNS :
+        path = pattern.sub(replacement, path)
+    return path if path in _ENDPOINTS else 'other'
+
+class Metrics :
+    def __init__(self) :
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.latency = {}       # (method, endpoint) -> [bucket counts, sum, count]
+        self.responses = {}     # (method, endpoint, status) -> count
+        self.transfers = {}     # direction -> [bytes, seconds, files]
+        self.counters = {}      # name -> count
+
+    def observe_request(self, method, endpoint, status, seconds) :
+        with self.lock :
+            histogram = self.latency.setdefault((method, endpoint), [[0] * len(LATENCY_BUCKETS), 0.0, 0])
+            for i, bound in enumerate(LATENCY_BUCKETS) :
+                if seconds <= bound :
+                    histogram[0][i] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+            key = (method, endpoint, str(status))
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def observe_transfer(self, direction, num_bytes, seconds, files=1) :
+        with self.lock :
+            transfer = self.transfers.setdefault(direction, [0, 0.0, 0])
+            transfer[0] += num_bytes
+            transfer[1] += seconds
+            transfer[2] += files
+
+    def count(self, name, value=1) :
+        with self.lock :
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self) :
+        with self.lock :
+            requests_total = sum(self.responses.values())
+            errors_total = sum(n for (method, endpoint, status), n in self.responses.items() if not status.startswith(('2', '3')))
+            return {
+                'time' : time.time(),
+                'uptime' : time.time() - self.started,
+                'requests' : [{'method' : m, 'endpoint' : e, 'status' : s, 'count' : n} for (m, e, s), n in sorted(self.responses.items())],
+                'latency' : [{'method' : m, 'endpoint' : e, 'count' : h[2], 'sum' : h[1], 'mean' : h[1] / h[2],
+                              'buckets' : dict(zip(map(str, LATENCY_BUCKETS), h[0]))} for (m, e), h in sorted(self.latency.items())],
+                'transfers' : {d : {'bytes' : t[0], 'seconds' : t[1], 'files' : t[2], 'mb_per_s' : t[0] / 1024 / 1024 / max(t[1], 1e-6)}
+                               for d, t in self.transfers.items()},
+                'counters' : dict(self.counters),
+                'error_rate' : errors_total / requests_total if requests_total else 0.0,
+            }
+
+    def prometheus_text(self) :
+        def labels(**kwargs) :
+            return '{' + ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in kwargs.items()) + '}'
+
+        lines = []
+        with self.lock :
+            lines.append('# TYPE rescale_request_duration_seconds histogram')
+            for (method, endpoint), (buckets, total, count) in sorted(self.latency.items()) :
+                for bound, n in zip(LATENCY_BUCKETS, buckets) :
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('rescale_request_duration_seconds_bucket%s %d' % (labels(method=method, endpoint=endpoint, le=le), n))
+                lines.append('rescale_request_duration_seconds_sum%s %f' % (labels(method=method, endpoint=endpoint), total))
+                lines.append('rescale_request_duration_seconds_count%s %d' % (labels(method=method, endpoint=endpoint), count))
+            lines.append('# TYPE rescale_requests_total counter')
+            for (method, endpoint, status), n in sorted(self.responses.items()) :
+                lines.append('rescale_requests_total%s %d' % (labels(method=method, endpoint=endpoint, status=status), n))
+            # One contiguous group per metric family, each with its own TYPE line
+            for index, (name, sample_format) in enumerate((('rescale_transfer_bytes_total', '%d'),
+                                                           ('rescale_transfer_seconds_total', '%f'),
+                                                           ('rescale_transfer_files_total', '%d'))) :
+                lines.append('# TYPE %s counter' % name)
+                for direction, transfer in sorted(self.transfers.items()) :
+                    lines.append(('%s%s ' + sample_format) % (name, labels(direction=direction), transfer[index]))
+            lines.append('# TYPE rescale_events_total counter')
+            for name, n in sorted(self.counters.items()) :
+                lines.append('rescale_events_total%s %d' % (labels(event=name), n))
+        return '\n'.join(lines) + '\n'
+
+    def export_prometheus(self, path) :
+        # Atomic replace so a node_exporter textfile collector never reads a partial file
+        tmp_path = path + '.' + uuid.uuid4().hex
+        with open(tmp_path, 'w') as f :
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def export_jsonl(self, path) :
+        with open(path, 'a') as f :
+            f.write(json.dumps(self.snapshot()) + '\n')
+
+_metrics = None
+
+def enable_metrics() :
+    global _metrics
+    if _metrics is None :
+        _metrics = Metrics()
+    return _metrics
+
+def disable_metrics() :
+    global _metrics
+    metrics, _metrics = _metrics, None
+    return metrics
+
+def get_metrics() :
+    return _metrics
+
+# 0.2 Metadata cache
+# Disabled by default, like the metrics. When enabled (enable_metadata_cache), job statuses are
+# cached for status_ttl seconds while a job is in flight and indefinitely once it is Completed.
+# Listing pages of a completed job never change and are cached indefinitely too, so
+# file_previous_job followed by job_download on the same job lists it only once. Entries live
+# in memory, or in a sqlite file shared by every script on the host when a path is given. The
+# least recently used entries are evicted beyond max_bytes of cached JSON.
+METADATA_STATUS_TTL = 5
+METADATA_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+class MetadataCache :
+    def __init__(self, path=None, status_ttl=METADATA_STATUS_TTL, max_bytes=METADATA_CACHE_MAX_BYTES) :
+        self.path = path
+        self.status_ttl = status_ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # In memory: key -> (expires, JSON text), in least recently used order
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.db = None
+        if path :
+            import sqlite3
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            with self.db :
+                self.db.execute('CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT, expires REAL, size INTEGER, used REAL)')
+                self.db.execute('CREATE INDEX IF NOT EXISTS metadata_used ON metadata (used)')
+
+    def get(self, key) :
+        # Cached value, or None when missing or expired
+        now = time.time()
+        with self.lock :
+            if self.db is None :
+                entry = self.entries.get(key)
+                if entry is not None and entry[0] is not None and entry[0] < now :
+                    self.size -= len(self.entries.pop(key)[1])
+                    entry = None
+                if entry is not None :
+                    self.entries.move_to_end(key)
+            else :
+                entry = self.db.execute('SELECT expires, value FROM metadata WHERE key = ?', (key,)).fetchone()
+                if entry is not None and entry[0] is not None and entry[0] < now :
+                    entry = None
+                if entry is not None :
+                    with self.db :
+                        self.db.execute('UPDATE metadata SET used = ? WHERE key = ?', (now, key))
+
+        if _metrics is not None :
+            _metrics.count('metadata_cache_hits' if entry is not None else 'metadata_cache_misses')
+        return None if entry is None else json.loads(entry[1])
+
+    def put(self, key, value, ttl=None) :
+        # Store value (JSON serialisable), forever when ttl is None
+        now = time.time()
+        text = json.dumps(value)
+        expires = None if ttl is None else now + ttl
+        with self.lock :
+            if self.db is None :
+                if key in self.entries :
+                    self.size -= len(self.entries.pop(key)[1])
+                self.entries[key] = (expires, text)
+                self.size += len(text)
+                while self.size > self.max_bytes and len(self.entries) > 1 :
+                    self.size -= len(self.entries.popitem(last=False)[1][1])
+            else :
+                with self.db :
+                    self.db.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)', (key, text, expires, len(text), now))
+                    self._evict_db(now)
+
+    def _evict_db(self, now) :
+        self.db.execute('DELETE FROM metadata WHERE expires IS NOT NULL AND expires < ?', (now,))
+        excess = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM metadata').fetchone()[0] - self.max_bytes
+        if excess <= 0 :
+            return
+        evicted = []
+        for key, size in self.db.execute('SELECT key, size FROM metadata ORDER BY used') :
+            if excess <= 0 :
+                break
+            evicted.append((key,))
+            excess -= size
+        self.db.executemany('DELETE FROM metadata WHERE key = ?', evicted)
+
+    def clear(self) :
+        with self.lock :
+            self.entries.clear()
+            self.size = 0
+            if self.db is not None :
+                with self.db :
+                    self.db.execute('DELETE FROM metadata')
+
+    def close(self) :
+        if self.db is not None :
+            self.db.close()
+            self.db = None
+
+_metadata_cache = None
+
+def enable_metadata_cache(path=None, status_ttl=METADATA_STATUS_TTL, max_bytes=METADATA_CACHE_MAX_BYTES) :
+    # path: sqlite file shared between processes, e.g. ~/.config/rescale/metadata.sqlite
+    global _metadata_cache
+    if _metadata_cache is not None :
+        _metadata_cache.close()
+    _metadata_cache = MetadataCache(path, status_ttl, max_bytes)
+    return _metadata_cache
+
+def disable_metadata_cache() :
+    global _metadata_cache
+    cache, _metadata_cache = _metadata_cache, None
+    if cache is not None :
+        cache.close()
+    return cache
+
+def get_metadata_cache() :
+    return _metadata_cache
+
+def _status_key(client, job_id) :
+    return client.rescale_platform + '|status|' + job_id
+
+def _cached_completed(client, job_id) :
+    # True when the cache already knows job_id is finished; never asks the API
+    return _metadata_cache is not None and _metadata_cache.get(_status_key(client, job_id)) in JOB_TERMINAL_STATUSES
 
 # 1. Get platform information
-def platform_my_token(rescale_platform,my_token):
-    api_key = None
-    rescale_platform = None
-
-    # Determine the configuration file path based on the operating system
-    if (platform.system() == 'Windows' ):
-        apiconfig_file = os.environ['USERPROFILE']+"\\.config\\rescale\\apiconfig"
-    else:
-        apiconfig_file = os.environ['HOME']+"/.config/rescale/apiconfig"
-
-    try:
-        with open(apiconfig_file, 'r') as f:
-            lines = f.readlines()
-
-            # Extract API key and platform information from the configuration file
-            rescale_platform =lines[1].split('=')[1].rstrip('\n').lstrip().replace("'","")
-            api_key =lines[2].split('=')[1].rstrip('\n').lstrip().replace("'","")
-    except (IOError, IndexError, KeyError) as e:
-        print(f"Error reading apiconfig file: {e}")
-        exit(1)
+# apiconfig is the Rescale CLI configuration: optional [profile] headers followed by
+# 'key = value' lines (apibaseurl, apikey); blank lines and # or ; comments are ignored.
+# Parsed and validated settings are cached per file until its mtime or size changes.
+_apiconfig_cache = {}
+
+def apiconfig_path() :
+    return os.path.join(_config_dir(), 'apiconfig')
+
+def _parse_apiconfig(apiconfig_file) :
+    sections = {}
+    section = 'default'
+    with open(apiconfig_file, 'r') as f :
+        for lineno, line in enumerate(f, 1) :
+            line = line.strip()
+            if not line or line[0] in '#;' :
+                continue
+            if line.startswith('[') and line.endswith(']') :
+                section = line[1:-1].strip()
+                continue
+            if '=' not in line :
+                raise RescaleConfigError(f"{apiconfig_file}:{lineno}: expected 'key = value'")
+            key, value = line.split('=', 1)
+            sections.setdefault(section, {})[key.strip().lower()] = value.strip().strip('\'"')
+    return sections
+
+def read_apiconfig(apiconfig_file=None, profile='default') :
+    # Return (rescale_platform, api_key) from apiconfig, raise RescaleConfigError when invalid
+    apiconfig_file = apiconfig_file or apiconfig_path()
+    try :
+        stat = os.stat(apiconfig_file)
+    except OSError as e :
+        raise RescaleConfigError(f"Error reading apiconfig file: {e}") from e
+
+    cache_key = (os.path.abspath(apiconfig_file), profile)
+    cached = _apiconfig_cache.get(cache_key)
+    if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size) :
+        return cached[1]
+
+    try :
+        sections = _parse_apiconfig(apiconfig_file)
+    except (IOError, UnicodeDecodeError) as e :
+        raise RescaleConfigError(f"Error reading apiconfig file: {e}") from e
+    if profile not in sections :
+        raise RescaleConfigError(f"Profile [{profile}] is not defined in {apiconfig_file}")
+    config = sections[profile]
 
     # Validate API key and platform information
-    if api_key is None :
-        print("API key should be defined in the $HOME/.config/rescale/apiconfig")
-        exit(1)
-
-    if rescale_platform is None :
-        print("Platform address should be defined in the $HOME/.config/rescale/apiconfig")
-        exit(1)
-
-    my_token = 'Token ' + api_key
+    rescale_platform = config.get('apibaseurl', '').rstrip('/')
+    api_key = config.get('apikey', '')
+    if not rescale_platform :
+        raise RescaleConfigError(f"Platform address (apibaseurl) should be defined in {apiconfig_file}")
+    if not re.match(r'^https?://[^/\s]+$', rescale_platform) :
+        raise RescaleConfigError(f"Invalid apibaseurl {rescale_platform!r} in {apiconfig_file}, e.g. https://platform.rescale.com")
+    if not api_key :
+        raise RescaleConfigError(f"API key (apikey) should be defined in {apiconfig_file}")
+    if re.search(r'\s', api_key) :
+        raise RescaleConfigError(f"Invalid apikey in {apiconfig_file}")
+
+    _apiconfig_cache[cache_key] = ((stat.st_mtime_ns, stat.st_size), (rescale_platform, api_key))
+    return rescale_platform, api_key
+
+def mask_token(my_token) :
+    # 'Token abcd...wxyz' -> 'Token ****wxyz', safe to print or log
+    scheme, _, key = my_token.rpartition(' ')
+    return (scheme + ' ' if scheme else '') + '****' + key[-4:]
+
+def platform_my_token(rescale_platform, my_token, apiconfig_file=None, profile='default'):
+    # Explicit arguments win, anything missing comes from apiconfig
+    if not (rescale_platform and my_token) :
+        config_platform, api_key = read_apiconfig(apiconfig_file, profile)
+        rescale_platform = rescale_platform or config_platform
+        my_token = my_token or 'Token ' + api_key
 
     print(f"rescale_platform = {rescale_platform}")
-    print(f"my_token = {my_token}")
+    print(f"my_token = {mask_token(my_token)}")
 
     return rescale_platform, my_token
 
 # 2. Create input tar file regarding given path
-def create_tar_gz(input_path=None, output_filename="rescale.tar.gz") :
+# Files written by this script itself (job ID files and shortcuts, download manifests and
+# partial downloads, byte code) are never packed. exclude adds glob patterns matched against
+# the relative path and the file name. When walking sub directories, the output directory of
+# a job downloaded here (a <job_name> directory next to <job_name>.job, or any directory with
+# a download manifest) is skipped, so earlier outputs do not become inputs of the next run.
+PACKAGE_EXCLUDE = ('*.job', '*.desktop', '*.url', '.rescale_manifest.jsonl', '*.part', '*.part.ranges', '__pycache__', '*.pyc')
+
+def _package_excluded(arcname, exclude) :
+    filename = arcname.rsplit('/', 1)[-1]
+    return any(fnmatch.fnmatchcase(arcname, pattern) or fnmatch.fnmatchcase(filename, pattern) for pattern in exclude)
+
+def _is_download_dir(root, name) :
+    return (os.path.isfile(os.path.join(root, name + '.job'))
+            or os.path.isfile(os.path.join(root, name, DOWNLOAD_MANIFEST)))
+
+def _input_file_list(input_path, recursive=False, exclude=()) :
+    # Return (file_path, arcname) pairs, walking sub directories when recursive
+    exclude = tuple(exclude) + PACKAGE_EXCLUDE
+    file_list = []
+    if recursive :
+        for root, dirs, files in os.walk(input_path) :
+            dirs[:] = sorted(d for d in dirs if not _package_excluded(d, exclude) and not _is_download_dir(root, d))
+            for file in sorted(files) :
+                file_path = os.path.join(root, file)
+                arcname = os.path.relpath(file_path, input_path).replace(os.sep, '/')
+                if not _package_excluded(arcname, exclude) :
+                    file_list.append((file_path, arcname))
+    else :
+        for file in sorted(os.listdir(input_path)) :
+            file_path = os.path.join(input_path, file)
+            if os.path.isfile(file_path) and not _package_excluded(file, exclude) :
+                file_list.append((file_path, file))
+    return file_list
+
+def create_tar_gz(input_path=None, output_filename="rescale.tar.gz", recursive=False, workers=None, compresslevel=6) :
     # If no input path is provided, use the current execution directory
     if not input_path:
         input_path = os.getcwd()
 
-    # Get the list of files in the input path
-    file_list = [f for f in os.listdir(input_path) if os.path.isfile(os.path.join(input_path, f))]
-
-    # Create a tar.gz file
-    with tarfile.open(output_filename, "w:gz") as tar:
-        for file in file_list:
-            file_path = os.path.join(input_path, file)
-            tar.add(file_path, arcname=os.path.basename(file_path))
+    # Create a tar.gz file, compressed on several cores
+    with open(output_filename, 'wb') as f :
+        for chunk in stream_tar_gz(input_path, recursive, workers, compresslevel, exclude=(os.path.basename(output_filename),)) :
+            f.write(chunk)
 
-    print(f"Successfully created rescale.tar.gz in {os.getcwd()}")
+    print(f"Successfully created {output_filename} in {os.getcwd()}")
 
     return
 
+# 2.1 Streaming, parallel-compressed packaging
+# The tar stream is cut into GZIP_BLOCK_SIZE blocks that are deflated on a thread pool
+# (zlib releases the GIL) and stitched back, pigz style, into one standard gzip member.
+# Compressed blocks are yielded in order as soon as they are ready, so the archive can be
+# piped straight into an upload without an intermediate file.
+GZIP_BLOCK_SIZE = 4 * 1024 * 1024
+PACKAGE_CODECS = ('gzip', 'tar')
+PACKAGE_SUFFIXES = {'gzip' : '.tar.gz', 'tar' : '.tar'}
+
+def _deflate_block(block, compresslevel, last) :
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+class _StreamCancelled(Exception) :
+    # The consumer of stream_tar_gz stopped; unwinds the producer so it closes its input files
+    pass
+
+def _put_unless_cancelled(out_queue, item, cancelled) :
+    # Blocking put on the bounded queue that gives up once the consumer is gone
+    while True :
+        try :
+            out_queue.put(item, timeout=0.1)
+            return
+        except queue.Full :
+            if cancelled.is_set() :
+                raise _StreamCancelled()
+
+class _ParallelGzipWriter :
+    # File-like sink for tarfile; pushes futures of compressed blocks onto out_queue
+    def __init__(self, executor, out_queue, compresslevel=6, codec='gzip', cancelled=None) :
+        self.executor = executor
+        self.out_queue = out_queue
+        self.cancelled = cancelled or threading.Event()
+        self.compresslevel = compresslevel
+        self.codec = codec
+        self.buffer = bytearray()
+        self.crc = 0
+        self.size = 0
+        if codec == 'gzip' :
+            # gzip header: deflate, no flags, mtime 0 (reproducible), unknown OS
+            self._put(b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff')
+
+    def _put(self, data) :
+        future = concurrent.futures.Future()
+        future.set_result(data)
+        _put_unless_cancelled(self.out_queue, future, self.cancelled)
+
+    def _emit(self, last) :
+        block = bytes(self.buffer)
+        self.buffer = bytearray()
+        if self.codec == 'gzip' :
+            self.crc = zlib.crc32(block, self.crc)
+            _put_unless_cancelled(self.out_queue, self.executor.submit(_deflate_block, block, self.compresslevel, last), self.cancelled)
+        elif block :
+            self._put(block)
+
+    def write(self, data) :
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= GZIP_BLOCK_SIZE :
+            rest = self.buffer[GZIP_BLOCK_SIZE:]
+            self.buffer = self.buffer[:GZIP_BLOCK_SIZE]
+            self._emit(False)
+            self.buffer = rest
+        return len(data)
+
+    def close(self) :
+        self._emit(True)
+        if self.codec == 'gzip' :
+            self._put(struct.pack('<II', self.crc & 0xffffffff, self.size & 0xffffffff))
+
+def stream_tar_gz(input_path=None, recursive=True, workers=None, compresslevel=6, codec='gzip', exclude=(), file_list=None) :
+    # Generator of archive bytes for input_path; codec 'gzip' (parallel) or 'tar' (no compression)
+    # file_list, a list of (file_path, arcname), packs exactly those files instead of walking input_path
+    if not input_path:
+        input_path = os.getcwd()
+    if codec not in PACKAGE_CODECS :
+        raise ValueError(f"Unknown codec {codec}, use one of {PACKAGE_CODECS}")
+
+    workers = workers or os.cpu_count() or 1
+    if file_list is None :
+        file_list = _input_file_list(input_path, recursive, exclude)
+    # Bounded so the tar producer never runs far ahead of the consumer
+    out_queue = queue.Queue(maxsize=workers * 2)
+    done = object()
+    # Set when the consumer stops early (generator closed, failed upload), so the producer exits
+    cancelled = threading.Event()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor :
+
+        def producer() :
+            try :
+                import tarfile
+                writer = _ParallelGzipWriter(executor, out_queue, compresslevel, codec, cancelled)
+                with tarfile.open(fileobj=writer, mode='w|') as tar :
+                    for file_path, arcname in file_list :
+                        tar.add(file_path, arcname=arcname)
+                writer.close()
+                _put_unless_cancelled(out_queue, done, cancelled)
+            except BaseException as e :
+                if cancelled.is_set() :
+                    return
+                failed = concurrent.futures.Future()
+                failed.set_exception(e)
+                try :
+                    _put_unless_cancelled(out_queue, failed, cancelled)
+                    _put_unless_cancelled(out_queue, done, cancelled)
+                except _StreamCancelled :
+                    pass
+
+        producer_thread = threading.Thread(target=producer, daemon=True)
+        producer_thread.start()
+
+        try :
+            while True :
+                future = out_queue.get()
+                if future is done :
+                    break
+                chunk = future.result()
+                if chunk :
+                    yield chunk
+        finally :
+            cancelled.set()
+            producer_thread.join()
+
+# 2.2 Content-addressed upload cache
+# Maps the sha256 of an uploaded file (or of a packaged input set) to the Rescale file ID
+# returned by /api/v2/files/contents/, per platform. Unchanged inputs are then referenced by
+# ID instead of being uploaded again. Entries expire after UPLOAD_CACHE_TTL seconds and the
+# least recently used ones are evicted beyond UPLOAD_CACHE_MAX_ENTRIES.
+UPLOAD_CACHE_TTL = 7 * 24 * 3600
+UPLOAD_CACHE_MAX_ENTRIES = 1000
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+_upload_cache_lock = threading.Lock()
+
+def _upload_cache_path() :
+    return os.path.join(_config_dir(), 'upload_cache.json')
+
+def file_digest(file_path) :
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f :
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b'') :
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def inputs_digest(file_list, *options, index=None) :
+    # Digest of a packaged input set: archive names, contents and packaging options.
+    # With a package index (see 3.4), files whose mtime and size are unchanged are not read again.
+    digest = hashlib.sha256(repr(options).encode())
+    for file_path, arcname in file_list :
+        file_hash = file_digest(file_path) if index is None else _indexed_digest(file_path, arcname, index)
+        digest.update(arcname.encode() + b'\0' + file_hash.encode())
+    return digest.hexdigest()
+
+def _load_upload_cache() :
+    try :
+        with open(_upload_cache_path(), 'r') as f :
+            return json.load(f)
+    except (IOError, ValueError) :
+        return {}
+
+def _save_upload_cache(cache) :
+    now = time.time()
+    for platform_entries in cache.values() :
+        for digest in [d for d, entry in platform_entries.items() if now - entry['created'] > UPLOAD_CACHE_TTL] :
+            del platform_entries[digest]
+        if len(platform_entries) > UPLOAD_CACHE_MAX_ENTRIES :
+            by_use = sorted(platform_entries, key=lambda d: platform_entries[d]['used'])
+            for digest in by_use[:len(platform_entries) - UPLOAD_CACHE_MAX_ENTRIES] :
+                del platform_entries[digest]
+
+    cache_path = _upload_cache_path()
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = cache_path + '.' + uuid.uuid4().hex
+    with open(tmp_path, 'w') as f :
+        json.dump(cache, f)
+    os.replace(tmp_path, cache_path)
+
+def upload_cache_lookup(rescale_platform, my_token, digest) :
+    # Return the cached Rescale file ID for digest, or None. The file is checked to still exist.
+    with _upload_cache_lock :
+        cache = _load_upload_cache()
+        entry = cache.get(rescale_platform, {}).get(digest)
+        if entry is None or time.time() - entry['created'] > UPLOAD_CACHE_TTL :
+            return None
+
+    client = get_client(rescale_platform, my_token)
+    if client.get('/api/v2/files/' + entry['id'] + '/').status_code != 200 :
+        with _upload_cache_lock :
+            cache = _load_upload_cache()
+            cache.get(rescale_platform, {}).pop(digest, None)
+            _save_upload_cache(cache)
+        return None
+
+    with _upload_cache_lock :
+        cache = _load_upload_cache()
+        if digest in cache.get(rescale_platform, {}) :
+            cache[rescale_platform][digest]['used'] = time.time()
+            _save_upload_cache(cache)
+    return entry['id']
+
+def upload_cache_store(rescale_platform, digest, file_id, name) :
+    now = time.time()
+    with _upload_cache_lock :
+        cache = _load_upload_cache()
+        cache.setdefault(rescale_platform, {})[digest] = {'id' : file_id, 'name' : name, 'created' : now, 'used' : now}
+        _save_upload_cache(cache)
+
 # 3. Uploads local files to a specified platform
-def upload_local_files(rescale_platform,my_token,input_file="rescale.tar.gz") :
+def upload_local_files(rescale_platform,my_token,input_file="rescale.tar.gz",use_cache=False,progress=None) :
+    from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
+
+    client = get_client(rescale_platform, my_token)
 
     # Set the upload URL
-    upload_url = rescale_platform + '/api/v2/files/contents/'
+    upload_url = '/api/v2/files/contents/'
 
     # Split input file paths
     input_files = input_file.split()
@@ -101,17 +893,34 @@ def upload_local_files(rescale_platform,my_token,input_file="rescale.tar.gz") :
     # Iterate through each input file
     for i in range(len(input_files)) :
         try:
+            # Reuse an earlier upload of identical content
+            if use_cache :
+                digest = file_digest(input_files[i])
+                cached_id = upload_cache_lookup(rescale_platform, my_token, digest)
+                if cached_id is not None :
+                    print('- ' + input_files[i] + ' unchanged, using cached file ' + cached_id)
+                    inputfile_id[i] = cached_id
+                    inputfiles_list.append({'id':inputfile_id[i],'decompress':True})
+                    continue
+
             # Open the file in binary mode
             with open(input_files[i], 'rb') as ifile:
 
                 encoder = MultipartEncoder(fields={'file': (ifile.name, ifile)})
-                monitor = MultipartEncoderMonitor(encoder)
+                start_time = time.time()
+                callback = None
+                if progress is not None :
+                    callback = lambda m: progress(m.bytes_read, m.len, time.time() - start_time)
+                monitor = MultipartEncoderMonitor(encoder, callback)
 
                 # Make a request to upload the file
-                upload_file = requests.post(
+                upload_file = client.post(
                     upload_url,
                     data=monitor,
-                    headers={'Authorization' : my_token,'Content-Type': encoder.content_type})
+                    headers={'Content-Type': encoder.content_type})
+
+                if _metrics is not None :
+                    _metrics.observe_transfer('upload', encoder.len, time.time() - start_time)
 
                 # Check if the upload was successful
                 if (upload_file.status_code == 201) :
@@ -120,38 +929,313 @@ def upload_local_files(rescale_platform,my_token,input_file="rescale.tar.gz") :
                     upload_file_dict = json.loads(upload_file.text)
                     inputfile_id[i] = upload_file_dict['id']
                     inputfiles_list.append({'id':inputfile_id[i],'decompress':True})
+                    if use_cache :
+                        upload_cache_store(rescale_platform, digest, inputfile_id[i], os.path.basename(input_files[i]))
                 else:
                     print('- ' + input_files[i] + ' upload failed')
-                    exit(1)
+                    check_response(upload_file, (201,), input_files[i] + ' upload failed')
 
         except FileNotFoundError as e:
-            print (e)
-            exit(1)
+            raise RescaleError(str(e)) from e
 
     print("All files uploaded successfully!")
     print(f"inputfiles_list = {inputfiles_list}")
     return inputfiles_list
 
+# 3.1 Upload a stream of bytes as a single Rescale file (chunked transfer, no temporary file)
+def upload_stream(rescale_platform, my_token, filename, chunks) :
+
+    client = get_client(rescale_platform, my_token)
+    boundary = uuid.uuid4().hex
+    sent_bytes = 0
+    start_time = time.time()
+
+    def body() :
+        nonlocal sent_bytes
+        yield (f'--{boundary}\r\n'
+               f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+               f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        for chunk in chunks :
+            sent_bytes += len(chunk)
+            yield chunk
+        yield f'\r\n--{boundary}--\r\n'.encode()
+
+    upload_file = client.post(
+        '/api/v2/files/contents/',
+        data=body(),
+        headers={'Content-Type': 'multipart/form-data; boundary=' + boundary})
+
+    if _metrics is not None :
+        _metrics.observe_transfer('upload', sent_bytes, time.time() - start_time)
+
+    if (upload_file.status_code != 201) :
+        print('- ' + filename + ' upload failed')
+        check_response(upload_file, (201,), filename + ' upload failed')
+
+    print('- ' + filename + ' uploaded')
+    return json.loads(upload_file.text)
+
+# 3.2 Package the input directory and stream it into the upload
+def package_and_upload(rescale_platform, my_token, input_path=None, output_filename=None, recursive=True, workers=None, compresslevel=6, codec='gzip', use_cache=False) :
+
+    # The platform decompresses the upload by its name, so the name has to match the codec
+    if codec not in PACKAGE_CODECS :
+        raise ValueError(f"Unknown codec {codec}, use one of {PACKAGE_CODECS}")
+    if not output_filename :
+        output_filename = 'rescale' + PACKAGE_SUFFIXES[codec]
+    elif codec == 'tar' and output_filename.endswith(('.gz', '.tgz')) :
+        raise ValueError(f"{output_filename} is a gzip name, but codec 'tar' uploads an uncompressed tar; use a .tar name")
+
+    if use_cache :
+        # Key the archive by the content of what would be packed
+        file_list = _input_file_list(input_path or os.getcwd(), recursive, (output_filename,))
+        digest = inputs_digest(file_list, output_filename, codec)
+        cached_id = upload_cache_lookup(rescale_platform, my_token, digest)
+        if cached_id is not None :
+            print('- ' + output_filename + ' inputs unchanged, using cached file ' + cached_id)
+            inputfiles_list = [{'id':cached_id,'decompress':True}]
+            print(f"inputfiles_list = {inputfiles_list}")
+            return inputfiles_list
+
+    chunks = stream_tar_gz(input_path, recursive, workers, compresslevel, codec, exclude=(output_filename,))
+    upload_file_dict = upload_stream(rescale_platform, my_token, output_filename, chunks)
+    inputfiles_list = [{'id':upload_file_dict['id'],'decompress':True}]
+
+    if use_cache :
+        upload_cache_store(rescale_platform, digest, upload_file_dict['id'], output_filename)
+
+    print(f"inputfiles_list = {inputfiles_list}")
+    return inputfiles_list
+
+# 3.3 Parallel multi-part upload for large files
+# The file is split into part_size slices that are uploaded concurrently as separate Rescale
+# files (<name>.partNNNN, decompress off). A failed part is retried on its own instead of
+# restarting the whole transfer. The returned command rebuilds the file on the cluster and
+# is passed to job_setup as pre_command.
+UPLOAD_PART_SIZE = 256 * 1024 * 1024
+UPLOAD_WORKERS = 4
+UPLOAD_RETRIES = 3
+
+class _FilePart :
+    # Read-only view of [offset, offset + length) of a file that reports bytes read
+    def __init__(self, file_path, offset, length, on_read) :
+        self.name = file_path
+        self.fd = open(file_path, 'rb')
+        self.fd.seek(offset)
+        self.remaining = length
+        self.on_read = on_read
+
+    @property
+    def len(self) :
+        # requests_toolbelt treats len as the number of bytes still to be read
+        return self.remaining
+
+    def read(self, size=-1) :
+        if size is None or size < 0 or size > self.remaining :
+            size = self.remaining
+        data = self.fd.read(size)
+        self.remaining -= len(data)
+        self.on_read(len(data))
+        return data
+
+    def close(self) :
+        self.fd.close()
+
+def print_progress(bytes_done, total_bytes, elapsed) :
+    # Default progress callback: percentage and throughput on one line
+    print('\r- %.1f%% of %.1f MB, %.2f MB/s' % (100.0 * bytes_done / max(total_bytes, 1), total_bytes/1024/1024,
+          bytes_done/1024/1024/max(elapsed, 1e-6)), end='')
+    sys.stdout.flush()
+
+def reassemble_command(filename, part_count, decompress=False) :
+    # Shell snippet that joins the uploaded parts back into filename on the cluster
+    parts = ' '.join(_part_name(filename, index, part_count) for index in range(part_count))
+    command = f'\ncat {parts} > {filename} && rm -f {parts}\n'
+    if decompress :
+        command += f'tar -xzf {filename} && rm -f {filename}\n'
+    return command
+
+def _part_name(filename, index, part_count) :
+    return '%s.part%0*d' % (filename, max(4, len(str(part_count - 1))), index)
+
+def upload_large_file(rescale_platform, my_token, file_path, part_size=UPLOAD_PART_SIZE, max_workers=UPLOAD_WORKERS, retries=UPLOAD_RETRIES, progress=None, decompress=False) :
+    from requests_toolbelt import MultipartEncoder
+
+    client = get_client(rescale_platform, my_token)
+    filename = os.path.basename(file_path)
+    total_bytes = os.path.getsize(file_path)
+    part_count = max(1, -(-total_bytes // part_size))
+
+    progress_lock = threading.Lock()
+    bytes_done = 0
+    start_time = time.time()
+
+    def on_read(n) :
+        nonlocal bytes_done
+        with progress_lock :
+            bytes_done += n
+            if progress is not None :
+                progress(bytes_done, total_bytes, time.time() - start_time)
+
+    def upload_part(index) :
+        offset = index * part_size
+        length = min(part_size, total_bytes - offset)
+        part_name = _part_name(filename, index, part_count)
+
+        for attempt in range(retries + 1) :
+            sent = [0]
+
+            def count(n) :
+                sent[0] += n
+                on_read(n)
+
+            part = _FilePart(file_path, offset, length, count)
+            try :
+                encoder = MultipartEncoder(fields={'file': (part_name, part, 'application/octet-stream')})
+                upload_file = client.post(
+                    '/api/v2/files/contents/',
+                    data=encoder,
+                    headers={'Content-Type': encoder.content_type})
+                if (upload_file.status_code == 201) :
+                    return json.loads(upload_file.text)['id']
+                error = f'HTTP {upload_file.status_code}'
+            except (RescaleConnectionError, CircuitOpenError, requests.RequestException) as e :
+                error = str(e)
+            finally :
+                part.close()
+
+            # Roll back the progress of the failed attempt before retrying this part only
+            on_read(-sent[0])
+            if _metrics is not None :
+                _metrics.count('upload_part_retries')
+            print(f'\n- {part_name} attempt {attempt + 1} failed: {error}')
+            if attempt < retries :
+                time.sleep(2 ** attempt)
+
+        raise RescaleError(f'{part_name} upload failed after {retries + 1} attempts')
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor :
+        futures = [executor.submit(upload_part, index) for index in range(part_count)]
+        try :
+            part_ids = [future.result() for future in futures]
+        except RescaleError as e :
+            for future in futures :
+                future.cancel()
+            print(f'\n- {filename} upload failed: {e}')
+            raise
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    if _metrics is not None :
+        _metrics.observe_transfer('upload', total_bytes, elapsed, part_count)
+    print(f'\n- {filename} uploaded in {part_count} parts, %.3f MB/s' % (total_bytes/1024/1024/elapsed))
+
+    inputfiles_list = [{'id':part_id,'decompress':False} for part_id in part_ids]
+    return inputfiles_list, reassemble_command(filename, part_count, decompress)
+
+# 3.4 Incremental packaging
+# A local package index keeps (mtime, size, sha256) of every input file per input directory,
+# so unchanged files are never hashed again. Files of at least static_min_size bytes (meshes,
+# restart files) go into a static bundle and everything else (keyword decks, scripts) into
+# the small changed bundle. Each bundle is keyed by its content in the upload cache, so a
+# one-line edit of the .inp deck re-packs and uploads only the changed bundle while the static
+# bundle is referenced by ID. Rescale decompresses both into the same working directory.
+STATIC_MIN_SIZE = 64 * 1024 * 1024
+STATIC_BUNDLE_NAME = 'rescale_static.tar.gz'
+
+_package_index_lock = threading.Lock()
+
+def _package_index_path() :
+    return os.path.join(_config_dir(), 'package_index.json')
+
+def _load_package_indexes() :
+    try :
+        with open(_package_index_path(), 'r') as f :
+            return json.load(f)
+    except (IOError, ValueError) :
+        return {}
+
+def load_package_index(input_path) :
+    # {arcname: [mtime_ns, size, sha256]} of the last packaging of input_path
+    return _load_package_indexes().get(os.path.abspath(input_path), {})
+
+def save_package_index(input_path, index) :
+    with _package_index_lock :
+        indexes = _load_package_indexes()
+        indexes[os.path.abspath(input_path)] = index
+        index_path = _package_index_path()
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        tmp_path = index_path + '.' + uuid.uuid4().hex
+        with open(tmp_path, 'w') as f :
+            json.dump(indexes, f)
+        os.replace(tmp_path, index_path)
+
+def _indexed_digest(file_path, arcname, index) :
+    # sha256 of file_path, read from index when mtime and size match; index is updated in place
+    stat = os.stat(file_path)
+    entry = index.get(arcname)
+    if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size :
+        return entry[2]
+    file_hash = file_digest(file_path)
+    index[arcname] = [stat.st_mtime_ns, stat.st_size, file_hash]
+    return file_hash
+
+def _upload_bundle(rescale_platform, my_token, input_path, name, file_list, index, workers, compresslevel) :
+    # Upload file_list as the tar.gz bundle name unless identical content is in the upload cache
+    digest = inputs_digest(file_list, name, 'gzip', index=index)
+    file_id = upload_cache_lookup(rescale_platform, my_token, digest)
+    if file_id is not None :
+        print(f'- {name} unchanged ({len(file_list)} files), using cached file {file_id}')
+        return file_id
+
+    chunks = stream_tar_gz(input_path, workers=workers, compresslevel=compresslevel, file_list=file_list)
+    file_id = upload_stream(rescale_platform, my_token, name, chunks)['id']
+    upload_cache_store(rescale_platform, digest, file_id, name)
+    return file_id
+
+def package_incremental(rescale_platform, my_token, input_path=None, output_filename="rescale.tar.gz", recursive=False, workers=None, compresslevel=6, static_min_size=STATIC_MIN_SIZE, exclude=()) :
+
+    input_path = input_path or os.getcwd()
+    file_list = _input_file_list(input_path, recursive, (output_filename, STATIC_BUNDLE_NAME) + tuple(exclude))
+    index = load_package_index(input_path)
+
+    static_files = []
+    changed_files = []
+    for file_path, arcname in file_list :
+        if os.path.getsize(file_path) >= static_min_size :
+            static_files.append((file_path, arcname))
+        else :
+            changed_files.append((file_path, arcname))
+
+    inputfiles_list = []
+    for name, bundle in ((STATIC_BUNDLE_NAME, static_files), (output_filename, changed_files)) :
+        if bundle :
+            file_id = _upload_bundle(rescale_platform, my_token, input_path, name, bundle, index, workers, compresslevel)
+            inputfiles_list.append({'id':file_id,'decompress':True})
+
+    # Keep only the files packed this time
+    save_package_index(input_path, {arcname : index[arcname] for _, arcname in file_list if arcname in index})
+
+    print(f"inputfiles_list = {inputfiles_list}")
+    return inputfiles_list
+
 # 4. Job setup
-def job_setup (rescale_platform, my_token, job_name, command, feature_name, feature_count, code_name, version_code, license_info, coretype_code, core_per_slot, slot, walltime, projectid, inputfiles_list):
+def build_job_spec (job_name, command, feature_name, feature_count, code_name, version_code, license_info, coretype_code, core_per_slot, slot, walltime, projectid, inputfiles_list, pre_command=''):
     # env command 
     env_command = '''
 sed -i.tmp 's/^comile_fortran/#&/' $HOME/abaqus_v6.env
 sed -i.tmp 's/^link_sl/#&/' $HOME/abaqus_v6.env
 rm abaqus_v6.env.tmp
 '''
-    # remove input rescale.tar.gz and compress all output
-    zip_command = '\nrm rescale.tar.gz \ntar --exclude=rescale_rest_api.py --exclude=main.py --exclude=process_output.log --exclude=__pycache__ --exclude=tmp -czvf rescale.tar.gz ./* \n'
+    # remove input rescale.tar.gz (and the static bundle of incremental packaging) and compress all output
+    zip_command = '\nrm rescale.tar.gz \nrm -f ' + STATIC_BUNDLE_NAME + ' \ntar --exclude=rescale_rest_api.py --exclude=main.py --exclude=process_output.log --exclude=__pycache__ --exclude=tmp -czvf rescale.tar.gz ./* \n'
     # remove all files except ouput rescale.tar.gz
     rm_command = '\nfind . ! -name "rescale.tar.gz" -type f -exec rm -f "{}" \; \nrm $HOME/work/process_output.log\nsleep 5'
     
-    job_command = env_command + command + zip_command + rm_command
+    # pre_command runs before the user command, e.g. reassembly of multi-part uploads
+    job_command = env_command + pre_command + command + zip_command + rm_command
 
-    # Rescale API for batch job configuration
-    job_url = rescale_platform + '/api/v2/jobs/'
-    job_setup = requests.post(
-        job_url,
-        json = {
+    # Rescale API job configuration
+    return {
             'name' : job_name,
             'isLowPriority' : False,
             'projectId' : projectid,
@@ -194,111 +1278,234 @@ rm abaqus_v6.env.tmp
                     'inputFiles' : inputfiles_list
                 },
             ] 
-        },
-        headers={'Content-Type' : 'application/json',
-                 'Authorization' : my_token}
+        }
+
+def create_job (rescale_platform, my_token, job_spec):
+    # POST a job spec, return the new job ID or raise RescaleApiError
+    client = get_client(rescale_platform, my_token)
+    job_setup = client.post(
+        '/api/v2/jobs/',
+        json = job_spec,
+        headers={'Content-Type' : 'application/json'}
     )
 
-    if (job_setup.status_code != 201) :
-        print (job_setup.text)
+    check_response(job_setup, (201,), 'Job creation failed')
+
+    job_id = json.loads(job_setup.text)['id'].strip()
+    if _job_history is not None :
+        _job_history.record_job(client.rescale_platform, job_id, job_spec)
+    return job_id
+
+def job_setup (rescale_platform, my_token, job_name, command, feature_name, feature_count, code_name, version_code, license_info, coretype_code, core_per_slot, slot, walltime, projectid, inputfiles_list, pre_command=''):
+
+    job_spec = build_job_spec(job_name, command, feature_name, feature_count, code_name, version_code, license_info, coretype_code, core_per_slot, slot, walltime, projectid, inputfiles_list, pre_command)
+
+    try :
+        job_id = create_job(rescale_platform, my_token, job_spec)
+    except RescaleApiError as e :
+        print (e.text)
         print ('Job creation failed')
-        exit(1)
+        raise
 
-    job_setup_dict = json.loads(job_setup.text)
-    job_id = job_setup_dict['id'].strip()
     print(f"Job_ID: {job_id}")
 
     return job_id 
 
 # 5. Submit job
+def submit_job_id (rescale_platform, my_token, job_id):
+    # Submit a created job or raise RescaleApiError
+    client = get_client(rescale_platform, my_token)
+    # Submitting the same job ID twice cannot start a second job, so this POST may be retried
+    submit_job = client.post('/api/v2/jobs/' + job_id + '/submit/', idempotent=True)
+    check_response(submit_job, (200,), 'Job submission failed')
+
+def _write_job_files (rescale_platform, job_name, job_id):
+    # <job_name>.job with the job ID and a desktop shortcut to the job results
+    job_info_filename = job_name+".job"
+    job_info_file = open(job_info_filename, 'w')
+    job_info_file.write(job_id)
+    job_info_file.close()
+
+    if (platform.system() == 'Windows' ):
+        job_url_filename = job_name+".url"
+        job_url_file = open(job_url_filename, 'w')
+        url = 'URL='+rescale_platform+'/jobs/'+job_id+'/runs/1/results/'
+        url = '[InternetShortcut]\n'+url
+    else:
+        job_url_filename = job_name+".desktop"
+        job_url_file = open(job_url_filename, 'w')
+        url = 'URL='+rescale_platform+'/jobs/'+job_id+'/runs/1/results/'
+        url = '[Desktop Entry]\nType=Link\n'+url
+
+    job_url_file.write(url)
+    job_url_file.close()
+
 def job_submit (rescale_platform, my_token, job_name, job_id):
 
     # Rescale API for batch job submission
-    job_submit_url = rescale_platform + '/api/v2/jobs/' + job_id + '/submit/'
-    submit_job = requests.post(
-        job_submit_url,
-        headers={'Authorization': my_token}
-    )
-    if (submit_job.status_code == 200) :
-        print ('Job ' + job_id + ' : submitted')
-        job_info_filename = job_name+".job"
-        job_info_file = open(job_info_filename, 'w')
-        job_info_file.write(job_id)
-        job_info_file.close()
-
-        if (platform.system() == 'Windows' ):
-            job_url_filename = job_name+".url"
-            job_url_file = open(job_url_filename, 'w')
-            url = 'URL='+rescale_platform+'/jobs/'+job_id+'/runs/1/results/'
-            url = '[InternetShortcut]\n'+url
-        else:
-            job_url_filename = job_name+".desktop"
-            job_url_file = open(job_url_filename, 'w')
-            url = 'URL='+rescale_platform+'/jobs/'+job_id+'/runs/1/results/'
-            url = '[Desktop Entry]\nType=Link\n'+url
-
-        job_url_file.write(url)
-        job_url_file.close()
-
-    else:
+    try :
+        submit_job_id(rescale_platform, my_token, job_id)
+    except RescaleApiError :
         print ('Job submission Failed')
-        exit(1)
+        raise
+
+    print ('Job ' + job_id + ' : submitted')
+    _write_job_files(rescale_platform, job_name, job_id)
 
     return
 
-# 6. Monitoring job
-def job_monitor (rescale_platform, my_token, job_id):
+# 5.1 Batch job creation and submission for parameter sweeps
+# base holds build_job_spec keyword arguments; each override replaces some of them (command,
+# coretype_code, core_per_slot, slot, walltime, inputfiles_list, ...) and may add 'env_vars'
+# merged into license_info. All specs are built up front, then created and submitted with at
+# most max_in_flight concurrent requests. One failure never stops the others.
+BATCH_MAX_IN_FLIGHT = 8
+
+def batch_job_submit(rescale_platform, my_token, base, overrides, max_in_flight=BATCH_MAX_IN_FLIGHT, write_job_files=True) :
+
+    job_specs = []
+    for index, override in enumerate(overrides) :
+        settings = dict(base)
+        settings.update({key: value for key, value in override.items() if key != 'env_vars'})
+        settings['license_info'] = dict(settings.get('license_info') or {}, **override.get('env_vars', {}))
+        settings.setdefault('pre_command', '')
+        if 'job_name' not in override :
+            settings['job_name'] = f"{base['job_name']}_{index + 1}"
+        job_specs.append((settings['job_name'], build_job_spec(**settings)))
+
+    def create_and_submit(index, job_name, job_spec) :
+        result = {'index' : index, 'job_name' : job_name, 'job_id' : None, 'status' : None, 'error' : None}
+        try :
+            result['job_id'] = create_job(rescale_platform, my_token, job_spec)
+        except (RescaleError, requests.RequestException, ValueError, KeyError) as e :
+            result['status'], result['error'] = 'create_failed', str(e)
+            return result
+        try :
+            submit_job_id(rescale_platform, my_token, result['job_id'])
+        except (RescaleError, requests.RequestException) as e :
+            result['status'], result['error'] = 'submit_failed', str(e)
+            return result
+        result['status'] = 'submitted'
+        if write_job_files :
+            # The job runs whether or not its local .job file can be written; keep its ID
+            try :
+                _write_job_files(rescale_platform, job_name, result['job_id'])
+            except OSError as e :
+                result['error'] = 'job files not written: ' + str(e)
+        return result
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight) as executor :
+        results = list(executor.map(lambda args: create_and_submit(*args),
+                                    [(index, job_name, job_spec) for index, (job_name, job_spec) in enumerate(job_specs)]))
+
+    submitted = sum(1 for result in results if result['status'] == 'submitted')
+    print(f'{submitted} of {len(results)} jobs submitted')
+    for result in results :
+        if result['error'] is not None :
+            print(f"- {result['job_name']} : {result['status']} {result['job_id'] or ''} ({result['error']})")
+
+    return results
 
-    job_status_url = rescale_platform + '/api/v2/jobs/' + job_id + '/statuses/'
+# 6. Monitoring job
+# Poll intervals come from a PollPolicy: each status has (min, max) seconds, the interval
+# grows with the time spent in the current status (age_fraction of the state age) and drops
+# back to the minimum on every status change. Random jitter spreads polls of many monitors.
+POLL_LIMITS = {
+    'Pending'   : (10, 120),
+    'Queued'    : (10, 300),
+    'Started'   : (5, 60),
+    'Validated' : (5, 60),
+    'Executing' : (15, 60),
+}
+POLL_DEFAULT_LIMITS = (5, 60)
+
+class PollPolicy :
+    def __init__(self, limits=None, default_limits=POLL_DEFAULT_LIMITS, age_fraction=0.1, jitter=0.2) :
+        self.limits = dict(POLL_LIMITS)
+        if limits :
+            self.limits.update(limits)
+        self.default_limits = default_limits
+        self.age_fraction = age_fraction
+        self.jitter = jitter
+
+    @classmethod
+    def fixed(cls, interval) :
+        # Constant interval for every status, no jitter
+        return cls(limits={status: (interval, interval) for status in POLL_LIMITS}, default_limits=(interval, interval), jitter=0)
+
+    def next_interval(self, status, state_age) :
+        min_interval, max_interval = self.limits.get(status, self.default_limits)
+        interval = min(max_interval, max(min_interval, state_age * self.age_fraction))
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+MONITOR_MAX_FAILURES = 20
+
+def get_job_status(client, job_id) :
+    # Latest status of a job; malformed answers raise RescaleTransientError
+    cache = _metadata_cache
+    if cache is not None :
+        status = cache.get(_status_key(client, job_id))
+        if status is not None :
+            return status
+
+    job_status = check_response(client.get('/api/v2/jobs/' + job_id + '/statuses/'), (200,), 'Status of job ' + job_id + ' failed')
+    try :
+        # Status history, newest first
+        results = json.loads(job_status.text)['results']
+        status = results[0]['status']
+    except (ValueError, KeyError, IndexError, TypeError) as e :
+        raise RescaleTransientError('Malformed status response for job ' + job_id, job_status.status_code, job_status.text) from e
+
+    if _job_history is not None :
+        _job_history.record_statuses(client.rescale_platform, job_id, [(entry.get('status'), entry.get('statusDate')) for entry in results])
+
+    if cache is not None :
+        cache.put(_status_key(client, job_id), status, None if status in JOB_TERMINAL_STATUSES else cache.status_ttl)
+    return status
+
+def job_monitor (rescale_platform, my_token, job_id, poll_policy=None, tail_mirror=None):
+
+    client = get_client(rescale_platform, my_token)
+    poll_policy = poll_policy or PollPolicy()
 
     prev_status = None
     current_status = None
     job_completed = False
+    state_since = time.time()
+    # Transient errors (after the client's own retries) are survived up to MONITOR_MAX_FAILURES in a row
+    failures = 0
 
-    # Tail out file
+    # Tail out file, only new lines are printed (and mirrored to tail_mirror if given)
     tail_out = 'process_output.log'
+    tailer = LogTailer(client, job_id, tail_out, mirror=tail_mirror)
 
     while job_completed == False :
         prev_status = current_status
-        job_status = requests.get(
-            job_status_url,
-            headers={'Authorization': my_token}
-        )
-        job_status_dict = json.loads(job_status.text)
-        current_status = job_status_dict['results'][0]['status']
+        if _metrics is not None :
+            _metrics.count('status_polls')
+        try :
+            current_status = get_job_status(client, job_id)
+            failures = 0
+        except (RescaleTransientError, RescaleConnectionError, CircuitOpenError) as e :
+            failures += 1
+            if failures > MONITOR_MAX_FAILURES :
+                raise
+            print(f'Job {job_id} : status poll failed ({e}), retrying')
+            current_status = prev_status
+            time.sleep(poll_policy.next_interval(current_status, 0) * min(failures, 10))
+            continue
 
         if (current_status != prev_status) :
             print ('Job ' + job_id + ' : ' + current_status)
+            state_since = time.time()
 
-            while current_status == 'Executing' :
-                # Live tail of tail out file
-                tail_file_url = rescale_platform + '/api/v2/jobs/' + job_id + '/runs/1/tail/' + tail_out
-                tail_file = requests.get(
-                    tail_file_url,
-                    headers={'Authorization': my_token},
-                    params={'lines':20}
-                )
-
-                try :
-                    tail_file_dict = json.loads(tail_file.text)
-                    print(json.dumps(tail_file_dict['lines'],indent=2))
-                except:
-                    print('Waiting.....')
-
-                sys.stdout.flush()
-                sys.stderr.flush()
-
-                time.sleep(15)
-
-                prev_status = current_status
-                job_status = requests.get(
-                    job_status_url,
-                    headers={'Authorization': my_token}
-                )
-                job_status_dict = json.loads(job_status.text)
-                current_status = job_status_dict['results'][0]['status']
-
-            # End of Live tail
+        if current_status == 'Executing' :
+            # Live tail of tail out file, a failed tail is simply retried on the next poll
+            try :
+                for line in tailer.poll() :
+                    print(line)
+            except (RescaleTransientError, RescaleConnectionError, CircuitOpenError) as e :
+                print(f'Job {job_id} : tail failed ({e})')
 
         if current_status == 'Completed':
            job_completed = True
@@ -306,129 +1513,815 @@ def job_monitor (rescale_platform, my_token, job_id):
         sys.stdout.flush()
         sys.stderr.flush()
 
-        time.sleep(5)
-
-    if job_completed != True :
-        print('Job execution Failed')
-        exit(1)
+        if not job_completed :
+            time.sleep(poll_policy.next_interval(current_status, time.time() - state_since))
 
     return
 
-# 7. Download job
-def job_download(rescale_platform, my_token, job_name, job_id) :
+# 6.1 Monitoring many jobs from one event loop
+# Each job is a coroutine on a single asyncio loop. Blocking HTTP calls run on a small thread
+# pool over the shared client, so hundreds of jobs share one connection pool and at most
+# max_in_flight requests are outstanding at a time. on_status(job_id, status) is called on
+# every status change and may be a plain function or a coroutine function. Poll intervals
+# follow poll_policy (see PollPolicy), or a fixed interval when one is given.
+JOB_TERMINAL_STATUSES = ('Completed',)
+
+async def monitor_jobs_async(rescale_platform, my_token, job_ids, on_status=None, interval=None, max_in_flight=None, poll_policy=None) :
+    import asyncio
+
+    client = get_client(rescale_platform, my_token)
+    if poll_policy is None :
+        poll_policy = PollPolicy.fixed(interval) if interval else PollPolicy()
+    max_in_flight = max_in_flight or client.pool_size
+    loop = asyncio.get_running_loop()
+    in_flight = asyncio.Semaphore(max_in_flight)
+    final_status = {}
+
+    async def get_status(job_id) :
+        if _metrics is not None :
+            _metrics.count('status_polls')
+        async with in_flight :
+            return await loop.run_in_executor(executor, get_job_status, client, job_id)
+
+    async def watch(job_id) :
+        current_status = None
+        state_since = loop.time()
+        while current_status not in JOB_TERMINAL_STATUSES :
+            prev_status = current_status
+            try :
+                current_status = await get_status(job_id)
+            except (ValueError, KeyError, IndexError, RescaleError, requests.RequestException) as e :
+                if isinstance(e, RescaleApiError) and not isinstance(e, RescaleTransientError) :
+                    # Unknown job or no access, polling again will not help
+                    print(f'Job {job_id} : status poll failed ({e}), giving up')
+                    return
+                print(f'Job {job_id} : status poll failed ({e}), retrying')
+                current_status = prev_status
+
+            if current_status != prev_status :
+                final_status[job_id] = current_status
+                state_since = loop.time()
+                if on_status is not None :
+                    result = on_status(job_id, current_status)
+                    if asyncio.iscoroutine(result) :
+                        await result
+                else :
+                    print ('Job ' + job_id + ' : ' + current_status)
+
+            if current_status not in JOB_TERMINAL_STATUSES :
+                await asyncio.sleep(poll_policy.next_interval(current_status, loop.time() - state_since))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight) as executor :
+        await asyncio.gather(*(watch(job_id) for job_id in job_ids))
+
+    return final_status
+
+def monitor_jobs(rescale_platform, my_token, job_ids, on_status=None, interval=None, max_in_flight=None, poll_policy=None) :
+    # Blocking wrapper; returns {job_id: last status}
+    import asyncio
+    return asyncio.run(monitor_jobs_async(rescale_platform, my_token, job_ids, on_status, interval, max_in_flight, poll_policy))
+
+# 6.2 Incremental log tailing
+# The tail endpoint only returns the last N lines, so LogTailer remembers the lines already
+# seen and aligns each new window against them to return only what is new. When no overlap
+# is found in a full window the window is doubled (up to max_window) before giving up, so
+# fast writers do not silently lose lines. The window also adapts to the output rate.
+# The first poll has nothing to align against and fetches max_window lines at once.
+TAIL_WINDOW = 50
+TAIL_MAX_WINDOW = 2000
+
+class LogTailer :
+    def __init__(self, client, job_id, filename='process_output.log', run=1, window=TAIL_WINDOW, max_window=TAIL_MAX_WINDOW, mirror=None) :
+        self.client = client
+        self.tail_url = '/api/v2/jobs/' + job_id + '/runs/' + str(run) + '/tail/' + filename
+        self.min_window = window
+        self.window = window
+        self.max_window = max_window
+        self.seen = collections.deque(maxlen=max_window)
+        self.mirror = mirror
+
+    def _fetch(self, lines) :
+        tail_file = self.client.get(self.tail_url, params={'lines':lines})
+        try :
+            return json.loads(tail_file.text)['lines']
+        except (ValueError, KeyError, TypeError) :
+            # Log file not created yet
+            return None
+
+    def _overlap(self, fetched) :
+        # Largest k such that the first k fetched lines are the last k lines already seen
+        seen = list(self.seen)
+        if not seen :
+            return 0
+        last = seen[-1]
+        for k in range(min(len(fetched), len(seen)), 0, -1) :
+            if fetched[k - 1] == last and fetched[:k] == seen[len(seen) - k:] :
+                return k
+        return 0
+
+    def poll(self) :
+        # Return the list of lines written since the previous poll
+        window = self.window if self.seen else self.max_window
+        while True :
+            fetched = self._fetch(window)
+            if fetched is None :
+                return []
+            overlap = self._overlap(fetched)
+            if overlap or not self.seen or len(fetched) < window or window >= self.max_window :
+                break
+            window = min(window * 2, self.max_window)
+
+        if not overlap and len(fetched) >= window :
+            if self.seen :
+                print(f'[tail] more than {window} new lines since the last poll, some lines were skipped')
+            else :
+                print(f'[tail] more than {window} lines before the first poll, the earlier lines were skipped')
+
+        new_lines = fetched[overlap:]
+        self.seen.extend(new_lines)
+        self.window = min(self.max_window, max(self.min_window, 2 * len(new_lines)))
+
+        if self.mirror is not None and new_lines :
+            with open(self.mirror, 'a') as f :
+                f.write('\n'.join(new_lines) + '\n')
+
+        return new_lines
+
+def tail_job_log(rescale_platform, my_token, job_id, filename='process_output.log', mirror=None, poll_policy=None) :
+    # Generator of new log lines while the job runs; ends when the job is Completed
+    client = get_client(rescale_platform, my_token)
+    poll_policy = poll_policy or PollPolicy()
+    tailer = LogTailer(client, job_id, filename, mirror=mirror)
+    state_since = time.time()
+    prev_status = None
 
-    list_output_files_url = rescale_platform + '/api/v2/jobs/' + job_id + '/files/'
+    while True :
+        if _metrics is not None :
+            _metrics.count('status_polls')
+        current_status = get_job_status(client, job_id)
+        if current_status != prev_status :
+            state_since = time.time()
+        prev_status = current_status
 
-    current_page = 1
-    file_count = 0
-    last_page = False
-    current_dir = os.getcwd()
+        if current_status in ('Executing',) + JOB_TERMINAL_STATUSES :
+            for line in tailer.poll() :
+                yield line
+        if current_status in JOB_TERMINAL_STATUSES :
+            return
+
+        time.sleep(poll_policy.next_interval(current_status, time.time() - state_since))
+
+# 6.3 Lazy job file listing
+# Pages of /api/v2/jobs/{id}/files/ are requested only when iteration reaches them, and the
+# first page serves both the total count and the first results, so no page is fetched twice.
+# Breaking out of the iteration stops further page requests.
+# Each API file record is reduced to a JobFile as soon as its page is parsed, and only the
+# current page is held, so memory stays constant however many files the job produced.
+class JobFile :
+    # Compact output file record: only the fields used for selection, download and chaining
+    __slots__ = ('id', 'path', 'relative_path', 'size', 'download_url', 'hash_function', 'file_hash')
+
+    def __init__(self, id, path, relative_path, size, download_url=None, hash_function=None, file_hash=None) :
+        self.id = id
+        self.path = path
+        self.relative_path = relative_path
+        self.size = size
+        self.download_url = download_url
+        self.hash_function = hash_function
+        self.file_hash = file_hash
+
+    @classmethod
+    def from_label(cls, label) :
+        hash_function, file_hash = _file_checksum(label)
+        relative_path = label.get('relativePath') or label['path']
+        return cls(label['id'], label.get('path', relative_path), relative_path, label['decryptedSize'],
+                   label.get('downloadUrl'), hash_function, file_hash)
+
+    @property
+    def name(self) :
+        return self.relative_path.rsplit('/', 1)[-1]
+
+    def as_tuple(self) :
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __repr__(self) :
+        return f'JobFile({self.id!r}, {self.relative_path!r}, {self.size})'
+
+class JobFileListing :
+    def __init__(self, client, job_id, page_size=None) :
+        self.client = client
+        self.job_id = job_id
+        self.url = '/api/v2/jobs/' + job_id + '/files/'
+        self.page_size = page_size
+        self._first_page = None
+
+    def _fetch(self, page) :
+        # Pages of completed jobs come from the metadata cache when it is enabled
+        cache_key = None
+        if _cached_completed(self.client, self.job_id) :
+            cache_key = f'{self.client.rescale_platform}|files|{self.job_id}|{self.page_size}|{page}'
+            cached = _metadata_cache.get(cache_key)
+            if cached is not None :
+                count, next_url, records = cached
+                return count, next_url, [JobFile(*record) for record in records]
+
+        params = {'page' : page}
+        if self.page_size :
+            params['page_size'] = self.page_size
+        response = check_response(self.client.get(self.url, params = params), (200,), 'Listing ' + self.url + ' failed')
+        try :
+            # Parsed from the raw bytes, without a decoded copy of the whole page
+            page_dict = json.loads(response.content)
+            page_data = page_dict['count'], page_dict['next'], [JobFile.from_label(label) for label in page_dict['results']]
+        except (ValueError, KeyError, TypeError) as e :
+            raise RescaleTransientError('Malformed listing response for ' + self.url, response.status_code, response.text) from e
+
+        if cache_key is not None :
+            _metadata_cache.put(cache_key, [page_data[0], page_data[1], [job_file.as_tuple() for job_file in page_data[2]]])
+        return page_data
+
+    @property
+    def count(self) :
+        if self._first_page is None :
+            self._first_page = self._fetch(1)
+        return self._first_page[0]
+
+    def __iter__(self) :
+        page = 1
+        page_data = self._first_page if self._first_page is not None else self._fetch(page)
+        # The first page is not kept once iteration moves past it
+        self._first_page = None
+        while True :
+            count, next_url, job_files = page_data
+            page_data = None
+            for job_file in job_files :
+                yield job_file
+            if (next_url == None):
+                return
+            page += 1
+            page_data = self._fetch(page)
+
+def iter_job_files(rescale_platform, my_token, job_id, page_size=None) :
+    # Generator over the output files of a job, as JobFile records
+    return iter(JobFileListing(get_client(rescale_platform, my_token), job_id, page_size))
 
-    list_output_files = requests.get(
-        list_output_files_url,
-        headers={'Authorization': my_token}
-    )
-    list_output_files_dict = json.loads(list_output_files.text)
+# 7. Download job
+# Output files are downloaded by a pool of workers while the main thread keeps fetching
+# listing pages, so page round trips overlap with transfers. Files are written to absolute
+# paths (no os.chdir) and in large chunks.
+# With resume=True, completed files are recorded in a manifest inside the job directory,
+# files matching the manifest are skipped and partial '.part' files are continued with HTTP
+# Range requests. Files larger than RANGE_SPLIT_SIZE are fetched as parallel byte ranges.
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_MANIFEST = '.rescale_manifest.jsonl'
+RANGE_SPLIT_SIZE = 256 * 1024 * 1024
+RANGE_PART_SIZE = 64 * 1024 * 1024
+
+def _download_local_path(top_dir, relative_path) :
+    # Map the job-relative path onto top_dir and refuse anything escaping it
+    local_path = os.path.normpath(os.path.join(top_dir, *relative_path.split('/')))
+    if os.path.commonpath([top_dir, local_path]) != top_dir :
+        raise ValueError('Unsafe output path: ' + relative_path)
+    return local_path
+
+def _file_checksum(label) :
+    # Return (hash_function, hex_digest) from the API file record, if any usable one exists
+    for checksum in label.get('fileChecksums') or [] :
+        hash_function = (checksum.get('hashFunction') or '').lower()
+        if hash_function in hashlib.algorithms_available and checksum.get('fileHash') :
+            return hash_function, checksum['fileHash'].lower()
+    return None, None
+
+def _hash_file(path, hash_function, chunk_size, limit=None) :
+    digest = hashlib.new(hash_function)
+    remaining = limit
+    with open(path, 'rb') as fd :
+        while remaining is None or remaining > 0 :
+            chunk = fd.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk :
+                break
+            digest.update(chunk)
+            if remaining is not None :
+                remaining -= len(chunk)
+    return digest
+
+def _load_manifest(manifest_path) :
+    # {relativePath: (id, size, hash)}, tuples keep resumed downloads of huge jobs small
+    manifest = {}
+    if os.path.exists(manifest_path) :
+        with open(manifest_path, 'r') as f :
+            for line in f :
+                try :
+                    entry = json.loads(line)
+                    manifest[entry['relativePath']] = (entry['id'], entry['size'], entry.get('hash'))
+                except (ValueError, KeyError) :
+                    # A torn last line from an interrupted run is simply ignored
+                    continue
+    return manifest
+
+def _manifest_match(entry, job_file, local_path) :
+    return (entry is not None
+            and entry == (job_file.id, job_file.size, job_file.file_hash)
+            and os.path.isfile(local_path)
+            and os.path.getsize(local_path) == job_file.size)
+
+def _download_stream(client, job_file, part_path, chunk_size, resume, hash_function) :
+    # Single-stream download into part_path, continuing from its current size when resuming
+    offset = os.path.getsize(part_path) if (resume and os.path.exists(part_path)) else 0
+    if offset >= job_file.size :
+        offset = 0
+
+    headers = {'Range' : 'bytes=%d-' % offset} if offset else {}
+    with client.get(job_file.download_url, stream=True, headers=headers) as response :
+        if offset and response.status_code == 200 :
+            # Server ignored the Range header, start over
+            offset = 0
+        elif (response.status_code not in (200, 206)) :
+            raise IOError(f"HTTP {response.status_code} while downloading {job_file.path}")
+
+        digest = None
+        if hash_function :
+            digest = _hash_file(part_path, hash_function, chunk_size, limit=offset) if offset else hashlib.new(hash_function)
+
+        file_bytes = 0
+        with open(part_path, 'r+b' if offset else 'wb') as fd:
+            fd.seek(offset)
+            fd.truncate()
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                fd.write(chunk)
+                if digest is not None :
+                    digest.update(chunk)
+                file_bytes += len(chunk)
+
+    return file_bytes, digest
+
+class _RangesNotSupported(IOError) :
+    # The server answered a range request with the whole file (200 instead of 206)
+    pass
+
+def _download_range(client, job_file, part_path, start, end, chunk_size) :
+    headers = {'Range' : 'bytes=%d-%d' % (start, end)}
+    range_bytes = 0
+    with client.get(job_file.download_url, stream=True, headers=headers) as response :
+        if (response.status_code == 200) :
+            raise _RangesNotSupported(f"Byte ranges not supported for {job_file.path}")
+        if (response.status_code != 206) :
+            raise IOError(f"HTTP {response.status_code} for byte range of {job_file.path}")
+        with open(part_path, 'r+b') as fd :
+            fd.seek(start)
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                fd.write(chunk)
+                range_bytes += len(chunk)
+    if range_bytes != end - start + 1 :
+        raise IOError(f"Short byte range for {job_file.path}")
+    return range_bytes
+
+def _download_ranges(client, job_file, part_path, chunk_size, resume, range_executor) :
+    # Split one large file into RANGE_PART_SIZE byte ranges fetched in parallel.
+    # Finished ranges are tracked next to the part file so a resumed run only fetches the rest.
+    size = job_file.size
+    ranges_path = part_path + '.ranges'
+    done_ranges = set()
+    if resume and os.path.exists(part_path) and os.path.exists(ranges_path) :
+        try :
+            with open(ranges_path, 'r') as f :
+                done_ranges = set(json.load(f))
+        except ValueError :
+            done_ranges = set()
+    else :
+        with open(part_path, 'wb') as fd :
+            fd.truncate(size)
+
+    ranges_lock = threading.Lock()
+
+    def fetch(start) :
+        range_bytes = _download_range(client, job_file, part_path, start, min(start + RANGE_PART_SIZE, size) - 1, chunk_size)
+        with ranges_lock :
+            done_ranges.add(start)
+            with open(ranges_path, 'w') as f :
+                json.dump(sorted(done_ranges), f)
+        return range_bytes
+
+    futures = [range_executor.submit(fetch, start) for start in range(0, size, RANGE_PART_SIZE) if start not in done_ranges]
+    concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+    failed = [future for future in futures if future.done() and not future.cancelled() and future.exception() is not None]
+    if failed :
+        # Stop queued ranges and let running ones finish, so nothing writes to part_path after
+        # this returns; ranges_path keeps the finished ones for the next resume
+        for future in futures :
+            future.cancel()
+        concurrent.futures.wait(futures)
+        raise failed[0].exception()
+
+    file_bytes = sum(future.result() for future in futures)
+    os.remove(ranges_path)
+    return file_bytes
+
+def _download_file(client, job_file, top_dir, chunk_size, resume=False, manifest=None, range_executor=None) :
+    local_path = _download_local_path(top_dir, job_file.relative_path)
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+
+    if resume and manifest is not None and _manifest_match(manifest.get(job_file.relative_path), job_file, local_path) :
+        return 0, True
+
+    part_path = local_path + '.part'
+    hash_function, file_hash = job_file.hash_function, job_file.file_hash
+    digest = None
+
+    if range_executor is not None and job_file.size >= RANGE_SPLIT_SIZE :
+        try :
+            file_bytes = _download_ranges(client, job_file, part_path, chunk_size, resume, range_executor)
+        except _RangesNotSupported :
+            # Ranges not honoured by the server, fall back to a single stream from scratch.
+            # Any other error fails the file and the next resume continues from the finished ranges.
+            if os.path.exists(part_path + '.ranges') :
+                os.remove(part_path + '.ranges')
+            file_bytes, digest = _download_stream(client, job_file, part_path, chunk_size, False, hash_function)
+    else :
+        file_bytes, digest = _download_stream(client, job_file, part_path, chunk_size, resume, hash_function)
+
+    if os.path.getsize(part_path) != job_file.size :
+        raise IOError(f"Size mismatch for {job_file.path}")
+    if file_hash :
+        if digest is None :
+            digest = _hash_file(part_path, hash_function, chunk_size)
+        if digest.hexdigest() != file_hash :
+            os.remove(part_path)
+            raise IOError(f"Checksum mismatch for {job_file.path}")
+
+    os.replace(part_path, local_path)
+    return file_bytes, False
+
+# 7.1 Output file selection
+# include/exclude are glob patterns (a string or a list) matched against both the relative
+# path and the file name; min_size/max_size bound decryptedSize in bytes. The listing
+# page_size is passed to the API so large jobs need fewer listing round trips; the API has
+# no glob filter, so patterns are applied to each listing page before anything is fetched.
+def _as_patterns(patterns) :
+    if not patterns :
+        return ()
+    return (patterns,) if isinstance(patterns, str) else tuple(patterns)
+
+def file_selected(job_file, include=None, exclude=None, min_size=None, max_size=None) :
+    relative_path = job_file.relative_path
+    filename = job_file.name
+
+    def matches(patterns) :
+        return any(fnmatch.fnmatchcase(relative_path, pattern) or fnmatch.fnmatchcase(filename, pattern) for pattern in patterns)
+
+    include, exclude = _as_patterns(include), _as_patterns(exclude)
+    if include and not matches(include) :
+        return False
+    if exclude and matches(exclude) :
+        return False
+    if min_size is not None and job_file.size < min_size :
+        return False
+    if max_size is not None and job_file.size > max_size :
+        return False
+    return True
+
+def job_download(rescale_platform, my_token, job_name, job_id, max_workers=DOWNLOAD_WORKERS, chunk_size=DOWNLOAD_CHUNK_SIZE, resume=False,
+                 include=None, exclude=None, min_size=None, max_size=None, page_size=None, dry_run=False) :
+
+    client = get_client(rescale_platform, my_token)
+    listing = JobFileListing(client, job_id, page_size)
+    # Keep every transfer on a pooled keep-alive connection. One connection stays free for the
+    # listing pages, file workers get at most the rest, and range workers what is left after
+    # them, counting the file worker that waits for its ranges
+    max_workers = max(1, min(max_workers, client.pool_size - 1))
+    range_workers = max(1, min(max_workers, client.pool_size - max_workers))
 
-    total_file_size = 0
-    files_count = list_output_files_dict['count']
+    file_count = 0
+    skipped_count = 0
+    selected_count = 0
+    selected_size = 0
+    failed_files = []
+    progress_lock = threading.Lock()
+    # Bound the number of queued downloads so listing never runs far ahead of the workers
+    pending = threading.BoundedSemaphore(max_workers * 4)
 
-    print ('Total ' + str(files_count) + ' files will be downloaded')
+    total_file_size = 0
+    files_count = listing.count
+    start_time = time.time()
+    filtered = bool(include or exclude or min_size is not None or max_size is not None)
+
+    if dry_run :
+        # Walk the listing only and report what would be downloaded
+        for job_file in listing :
+            if file_selected(job_file, include, exclude, min_size, max_size) :
+                selected_count += 1
+                selected_size += job_file.size
+                print (job_file.path + ' (%d bytes)' % job_file.size)
+
+        print ('Dry run: ' + str(selected_count) + ' of ' + str(files_count) + ' files, %.3f MB would be downloaded'%(selected_size/1024/1024))
+        return {'files' : selected_count, 'bytes' : selected_size}
+
+    if filtered :
+        print ('Total ' + str(files_count) + ' files in the job, only files matching the filters will be downloaded')
+    else :
+        print ('Total ' + str(files_count) + ' files will be downloaded')
     if files_count != 0 :
 
-        top_dir = job_name + '/'
-
-        if not(os.path.exists(top_dir)) :
-            os.makedirs(top_dir)
-
-        while (not(last_page)):
-
-            list_output_files = requests.get(
-                list_output_files_url,
-                params = {'page' : current_page},
-                headers={'Authorization': my_token}
-            )
-            list_output_files_dict = json.loads(list_output_files.text)
-
-            for label in list_output_files_dict['results'] :
-                path = ''
-
-                os.chdir(current_dir)
-                file_count += 1
-                total_file_size += label['decryptedSize']
-                relative_path = label['relativePath'].rsplit('/',1)[0]
-
-                if relative_path != label['relativePath'] :
-                    path = relative_path
-
-                if not os.path.exists(top_dir + path) :
-                    os.makedirs(top_dir + path)
-
-                os.chdir(top_dir + path)
-
-                downloadUrl = label['downloadUrl']
-                filename = os.path.basename(label['relativePath'])
-
-                response = requests.get(
-                    downloadUrl,
-                    headers={'Authorization': my_token}
-                )
-
-                with open(filename, 'wb') as fd:
-                    for chunk in response.iter_content(chunk_size=100):
-                        fd.write(chunk)
-                print (file_count, label['path']+' downloaded')
-
-
-            current_page += 1
-            if (list_output_files_dict['next'] == None):
-                last_page = True
-
+        top_dir = os.path.abspath(job_name)
+        os.makedirs(top_dir, exist_ok=True)
+
+        # The manifest is only read and written by resumable downloads
+        manifest_path = os.path.join(top_dir, DOWNLOAD_MANIFEST)
+        manifest = _load_manifest(manifest_path) if resume else {}
+        manifest_file = open(manifest_path, 'a') if resume else None
+
+        def download_worker(job_file) :
+            nonlocal file_count, skipped_count, total_file_size
+            try :
+                file_bytes, skipped = _download_file(client, job_file, top_dir, chunk_size, resume, manifest, range_executor)
+                with progress_lock :
+                    file_count += 1
+                    total_file_size += file_bytes
+                    if skipped :
+                        skipped_count += 1
+                        print (file_count, job_file.path+' already downloaded')
+                    else :
+                        if manifest_file is not None :
+                            manifest_file.write(json.dumps({
+                                'id' : job_file.id,
+                                'relativePath' : job_file.relative_path,
+                                'size' : job_file.size,
+                                'hash' : job_file.file_hash,
+                                'hashFunction' : job_file.hash_function}) + '\n')
+                            manifest_file.flush()
+                        print (file_count, job_file.path+' downloaded')
+            except (IOError, ValueError, RescaleError, requests.RequestException) as e :
+                if _metrics is not None :
+                    _metrics.count('download_failures')
+                with progress_lock :
+                    failed_files.append(job_file.path)
+                    print (f"- {job_file.path} download failed: {e}")
+            finally :
+                pending.release()
+
+        try :
+            with concurrent.futures.ThreadPoolExecutor(max_workers=range_workers) as range_executor, \
+                 concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor :
+                # The next listing page is fetched here while the workers are busy with this one
+                for job_file in listing :
+                    if filtered and not file_selected(job_file, include, exclude, min_size, max_size) :
+                        continue
+                    pending.acquire()
+                    executor.submit(download_worker, job_file)
+        finally :
+            if manifest_file is not None :
+                manifest_file.close()
+
+    elapsed = max(time.time() - start_time, 1e-6)
+    if _metrics is not None :
+        # Aggregate wall time of the whole download, workers overlap
+        _metrics.observe_transfer('download', total_file_size, elapsed, file_count - skipped_count)
     print ('Total ' + str(file_count) + ' files, %.3f MB downloaded'%(total_file_size/1024/1024))
+    if skipped_count :
+        print ('Skipped ' + str(skipped_count) + ' files already present in the manifest')
+    print ('Elapsed %.1f s, throughput %.3f MB/s'%(elapsed, total_file_size/1024/1024/elapsed))
 
-    return
+    if failed_files :
+        print ('Job download failed for ' + str(len(failed_files)) + ' files')
+        raise RescaleError(f'Job {job_id} download failed for {len(failed_files)} files: ' + ', '.join(failed_files[:10]))
 
-# 8. Get Rescale files from Previous Rescale Job  
-def file_previous_job(rescale_platform, my_token, job_id) :
+    return
 
-    inputfiles_list = []
-    list_output_files_url = rescale_platform + '/api/v2/jobs/' + job_id + '/files/'
+# 8. Get Rescale files from Previous Rescale Job
+# With archive_name, only that file (e.g. the rescale.tar.gz packed by the job command) is
+# forwarded and listing stops as soon as it is found. Otherwise include/exclude/size filters
+# select a subset. Only archives are marked for decompression.
+ARCHIVE_EXTENSIONS = ('.tar.gz', '.tgz', '.tar', '.tar.bz2', '.tbz2', '.tar.xz', '.zip')
 
-    current_page = 1
-    file_count = 0
-    last_page = False
+def _is_archive(filename) :
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
 
-    list_output_files = requests.get(
-        list_output_files_url,
-        headers={'Authorization': my_token}
-    )
-    list_output_files_dict = json.loads(list_output_files.text)
+def iter_previous_job_files(rescale_platform, my_token, job_id, archive_name=None, include=None, exclude=None, min_size=None, max_size=None, page_size=None) :
+    # Generator of job input entries {'id', 'decompress'} for the selected output files of job_id,
+    # listing pages are fetched as the entries are consumed
+    client = get_client(rescale_platform, my_token)
+    listing = JobFileListing(client, job_id, page_size)
 
-    files_count = list_output_files_dict['count']
+    if listing.count == 0 :
+        raise RescaleError(f'There is no file in previoous Rescale job {job_id}')
 
-    if files_count != 0 :
+    for job_file in listing :
+        if archive_name :
+            if archive_name in (job_file.relative_path, job_file.name) :
+                yield {'id':job_file.id,'decompress':_is_archive(job_file.name)}
+                return
+        elif file_selected(job_file, include, exclude, min_size, max_size) :
+            yield {'id':job_file.id,'decompress':_is_archive(job_file.name)}
 
-        while (not(last_page)):
+    if archive_name :
+        raise RescaleError(f'There is no {archive_name} in previous Rescale job {job_id}')
 
-            list_output_files = requests.get(
-                list_output_files_url,
-                params = {'page' : current_page},
-                headers={'Authorization': my_token}
-            )
-            list_output_files_dict = json.loads(list_output_files.text)
+def file_previous_job(rescale_platform, my_token, job_id, archive_name=None, include=None, exclude=None, min_size=None, max_size=None, page_size=None) :
 
-            for label in list_output_files_dict['results'] :
-                inputfiles_list.append({'id':label['id'],'decompress':True})
-                file_count += 1
+    # The job spec needs the whole list, but only {'id', 'decompress'} is kept per file
+    inputfiles_list = list(iter_previous_job_files(rescale_platform, my_token, job_id, archive_name, include, exclude, min_size, max_size, page_size))
 
-            current_page += 1
-            if (list_output_files_dict['next'] == None):
-                last_page = True
-
-    else:
-        print(f'There is no file in previoous Rescale job {job_id}')
-        exit(1)
-
-    print(f"inputfiles_list = {inputfiles_list}")
+    if len(inputfiles_list) > 20 :
+        print(f"inputfiles_list = {len(inputfiles_list)} files from job {job_id}")
+    else :
+        print(f"inputfiles_list = {inputfiles_list}")
     return inputfiles_list
 
+# 9. Job pipeline (DAG)
+# Each step is a dict: {'name', 'command', 'depends_on': [step names], 'job_name' (optional),
+# 'download' (optional)}. Steps without dependencies start from inputfiles_list; the others
+# start from the output files of all their parents. Independent steps run concurrently, up
+# to max_concurrent_jobs Rescale jobs at a time, and a step is submitted as soon as its last
+# parent completes. job_settings holds the job_setup keyword arguments shared by all steps.
+# chain_archive forwards only that output file of a parent (see file_previous_job).
+def _pipeline_order(steps) :
+    # Validate names and dependencies, return the steps in a topological order
+    by_name = {}
+    for step in steps :
+        if step['name'] in by_name :
+            raise ValueError('Duplicate pipeline step ' + step['name'])
+        by_name[step['name']] = step
+    for step in steps :
+        for parent in step.get('depends_on', []) :
+            if parent not in by_name :
+                raise ValueError(f"Step {step['name']} depends on unknown step {parent}")
+
+    order, state = [], {}
+    def visit(name) :
+        if state.get(name) == 'done' :
+            return
+        if state.get(name) == 'visiting' :
+            raise ValueError('Pipeline dependency cycle at ' + name)
+        state[name] = 'visiting'
+        for parent in by_name[name].get('depends_on', []) :
+            visit(parent)
+        state[name] = 'done'
+        order.append(by_name[name])
+    for step in steps :
+        visit(step['name'])
+    return order
+
+# 9.1 Pipeline state journal
+# Append-only JSON lines file with one record per stage change of a step (created, submitted,
+# completed, downloaded). Every record is flushed and fsync'ed before the pipeline moves on,
+# so a restarted pipeline can skip completed steps and reattach to jobs still running.
+JOURNAL_STAGES = ('created', 'submitted', 'completed', 'downloaded')
+
+class PipelineJournal :
+    def __init__(self, path) :
+        self.path = path
+        self.lock = threading.Lock()
+
+    def load(self) :
+        # Latest record per step name
+        state = {}
+        if os.path.exists(self.path) :
+            with open(self.path, 'r') as f :
+                for line in f :
+                    try :
+                        record = json.loads(line)
+                        state[record['step']] = record
+                    except (ValueError, KeyError) :
+                        # Torn last line from a crash
+                        continue
+        return state
+
+    def record(self, step, stage, **fields) :
+        record = dict(fields, step=step, stage=stage, time=time.time())
+        with self.lock :
+            with open(self.path, 'a') as f :
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        return record
+
+def _step_digest(step, job_settings, upstream) :
+    # Journal records are only reused when the step command, settings and inputs are unchanged.
+    # upstream: the input file IDs of a root step, or the job IDs of the parents of a chained step.
+    # The upload cache returns the same file IDs for unchanged inputs, so a plain resume still matches.
+    return hashlib.sha256(json.dumps([step['command'], step.get('depends_on', []), job_settings, upstream], sort_keys=True, default=str).encode()).hexdigest()
+
+def run_pipeline(rescale_platform, my_token, steps, job_settings, inputfiles_list=None, max_concurrent_jobs=4, poll_policy=None, journal=None, chain_archive=None) :
+
+    order = _pipeline_order(steps)
+    results = {step['name'] : {'job_id' : None, 'status' : 'waiting'} for step in order}
+    results_lock = threading.Lock()
+
+    journal = PipelineJournal(journal) if isinstance(journal, str) else journal
+    journal_state = journal.load() if journal is not None else {}
+
+    def run_step(step) :
+        parents = step.get('depends_on', [])
+        if parents :
+            upstream = [results[parent]['job_id'] for parent in parents]
+        else :
+            upstream = sorted(str(inputfile.get('id')) for inputfile in (inputfiles_list or []))
+        digest = _step_digest(step, job_settings, upstream)
+
+        def record(stage, **fields) :
+            if journal is not None :
+                journal.record(step['name'], stage, digest=digest, **fields)
+
+        previous = journal_state.get(step['name'])
+        if previous is not None and previous.get('digest') != digest :
+            previous = None
+        stage = previous['stage'] if previous else None
+
+        job_name = previous['job_name'] if previous else (step.get('job_name') or step['name'])
+        job_id = previous['job_id'] if previous else None
+
+        if stage is None :
+            if parents :
+                step_inputs = []
+                for parent in parents :
+                    step_inputs += file_previous_job(rescale_platform, my_token, results[parent]['job_id'], chain_archive)
+            else :
+                step_inputs = list(inputfiles_list or [])
+
+            job_id = job_setup(rescale_platform, my_token, job_name, step['command'], inputfiles_list=step_inputs, **job_settings)
+            record('created', job_id=job_id, job_name=job_name, inputfiles=step_inputs)
+            stage = 'created'
+        else :
+            print(f"{step['name']} : resuming job {job_id} from stage {stage}")
+
+        with results_lock :
+            results[step['name']]['job_id'] = job_id
+
+        if stage == 'created' :
+            job_submit(rescale_platform, my_token, job_name, job_id)
+            record('submitted', job_id=job_id, job_name=job_name)
+            stage = 'submitted'
+        if stage == 'submitted' :
+            # Also reattaches to a job that was still running when the pipeline stopped
+            job_monitor(rescale_platform, my_token, job_id, poll_policy)
+            record('completed', job_id=job_id, job_name=job_name)
+            stage = 'completed'
+        if stage == 'completed' and step.get('download') :
+            job_download(rescale_platform, my_token, job_name, job_id, resume=True)
+            record('downloaded', job_id=job_id, job_name=job_name)
+        return job_id
+
+    pending = list(order)
+    running = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent_jobs) as executor :
+        while pending or running :
+            # Start every step whose parents are all completed, skip those with a failed parent
+            for step in list(pending) :
+                parent_status = [results[parent]['status'] for parent in step.get('depends_on', [])]
+                if any(status in ('failed', 'skipped') for status in parent_status) :
+                    results[step['name']]['status'] = 'skipped'
+                    pending.remove(step)
+                elif all(status == 'completed' for status in parent_status) :
+                    results[step['name']]['status'] = 'running'
+                    running[executor.submit(run_step, step)] = step
+                    pending.remove(step)
+
+            if not running :
+                continue
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done :
+                step = running.pop(future)
+                try :
+                    future.result()
+                    results[step['name']]['status'] = 'completed'
+                except BaseException as e :
+                    # An error inside a step only fails that step and its dependents
+                    results[step['name']]['status'] = 'failed'
+                    print(f"Pipeline step {step['name']} failed: {e!r}")
+
+    for name, result in results.items() :
+        print(f"{name} : {result['status']} ({result['job_id']})")
+    return results
+
+# 10. Job history and analytics
+# Disabled by default. When enabled (enable_job_history), create_job and get_job_status record
+# every job's hardware and status history in a JobHistory (see rescale_history.py, which has
+# no HTTP dependencies so the report can be read without loading this module).
+_job_history = None
+
+def enable_job_history(path=None) :
+    # path: sqlite file, default ~/.config/rescale/job_history.sqlite
+    global _job_history
+    if _job_history is not None :
+        _job_history.close()
+    _job_history = JobHistory(path)
+    return _job_history
+
+def disable_job_history() :
+    global _job_history
+    history, _job_history = _job_history, None
+    if history is not None :
+        history.close()
+    return history
+
+def get_job_history() :
+    return _job_history
+
+def job_report(path=None, coretype=None) :
+    # Report rows from the enabled history, or from the history file at path
+    if path is None and _job_history is not None :
+        return _job_history.report(coretype)
+    return rescale_history.job_report(path, coretype)